@@ -1,2 +1,16 @@
 #!/bin/bash
-/app/.venv/bin/celery -A v2g.tasks worker --loglevel=info --concurrency=${V2G_CELERY_CONCURRENCY:-1} -P prefork
+# Usage: run_workers.sh [QUEUES]
+#
+# QUEUES is a comma-separated list of Celery queues to consume (all of them by default):
+# "celery" for probing and other light tasks, "small" and "large" for conversions by their cost.
+# Start one instance per queue to give every queue its own pool of workers.
+#
+# The pool and the number of slots are configured with V2G_CELERY_POOL and V2G_CELERY_CONCURRENCY
+# (see v2g.core.config). By default there is a slot per core, as long as the memory allows.
+QUEUES=${1:-${V2G_CELERY_QUEUES:-celery,small,large}}
+
+# The pool processes write their metrics into files, which the main process serves.
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc_dir}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+/app/.venv/bin/celery -A v2g.tasks worker --loglevel=info -Q "$QUEUES" -n "${QUEUES//,/-}@%h"
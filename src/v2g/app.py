@@ -1,7 +1,7 @@
+import os
 from contextlib import asynccontextmanager
 
 import aioboto3
-import redis.asyncio as aioredis
 from asgi_correlation_id import CorrelationIdMiddleware
 from fastapi import APIRouter, FastAPI
 from fastapi.openapi.utils import get_openapi
@@ -10,10 +10,21 @@ from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 
 from v2g.core.config import settings
-from v2g.middlewares.metrics import MetricsMiddleware, metrics_route
+from v2g.core.database import ensure_indexes
+from v2g.core.event_hub import EventHub
+from v2g.core.redis import create_async_redis_client
+from v2g.middlewares.body_size import BodySizeLimitMiddleware
+from v2g.middlewares.metrics import (
+    MetricsMiddleware,
+    mark_crashed_workers_dead,
+    mark_worker_dead,
+    metrics_route,
+)
 from v2g.modules.auth.routes import router as router_login
 from v2g.modules.conversions.models import ConversionWebhookBody
 from v2g.modules.conversions.routes import router as router_conversion
+from v2g.modules.events.routes import router as router_events
+from v2g.modules.uploads.routes import router as router_upload
 from v2g.modules.users.routes import router as router_user
 from v2g.modules.websocket.routes import router as router_ws
 from v2g.rate_limiter import limiter
@@ -22,34 +33,42 @@ router = APIRouter()
 router.include_router(router_login, prefix='/auth', tags=['Authentication'])
 router.include_router(router_user, prefix='/users', tags=['User'])
 router.include_router(router_conversion, prefix='/conversions', tags=['Conversion'])
+router.include_router(router_upload, prefix='/uploads', tags=['Upload'])
 router.include_router(router_ws, tags=['WebSocket'])
+router.include_router(router_events, prefix='/events', tags=['Events'])
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    mark_crashed_workers_dead()
     boto_session = aioboto3.Session()
     mongo_client_ = AsyncMongoClient(
         host=settings.mongodb.host,
         port=settings.mongodb.port,
     )
-    redis_client_ = aioredis.Redis(
-        host=settings.redis.host,
-        port=settings.redis.port,
-    )
-    async with (
-        mongo_client_ as mongo_client,
-        redis_client_ as redis_client,
-        boto_session.client('s3') as s3_client,
-    ):
-        yield {
-            'mongo_client': mongo_client,
-            'redis_client': redis_client,
-            's3_client': s3_client,
-        }
+    redis_client_ = create_async_redis_client()
+    try:
+        async with (
+            mongo_client_ as mongo_client,
+            redis_client_ as redis_client,
+            boto_session.client('s3') as s3_client,
+            EventHub(redis_client) as event_hub,
+        ):
+            await ensure_indexes(mongo_client.get_database(settings.mongodb.dbname))
+            yield {
+                'mongo_client': mongo_client,
+                'redis_client': redis_client,
+                's3_client': s3_client,
+                'event_hub': event_hub,
+            }
+    finally:
+        mark_worker_dead(os.getpid())
 
 
 app = FastAPI(lifespan=lifespan)
 
+# Leaves room for the multipart/form-data boundaries and other fields around the video.
+app.add_middleware(BodySizeLimitMiddleware, max_size=settings.upload_max_size + 1024 * 1024)
 app.add_middleware(MetricsMiddleware)
 app.add_route('/metrics', metrics_route, include_in_schema=False)
 
@@ -1,4 +1,5 @@
 import secrets
+from enum import StrEnum
 
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -12,11 +13,39 @@ PATHES_TO_SKIP_METRICS_FOR = (
 )
 
 
+class ConversionIngestMode(StrEnum):
+    # Download the source video into a temporary file in chunks, then run ffmpeg on it.
+    # Works for any container (e.g. MP4 files with the moov atom at the end).
+    FILE = 'file'
+    # Feed the source video into ffmpeg's stdin while it is being downloaded.
+    # ffmpeg starts right away, but the container must be streamable (WebM, MKV, MPEG-TS,
+    # fragmented or "faststart" MP4).
+    PIPE = 'pipe'
+
+
+class ConversionQueue(StrEnum):
+    # Probing and other light tasks.
+    DEFAULT = 'celery'
+    # Conversions are routed by their estimated cost, so short clips don't wait behind long videos.
+    SMALL = 'small'
+    LARGE = 'large'
+
+
+class CeleryPool(StrEnum):
+    # A process per slot, so every slot pays for its own Python interpreter.
+    PREFORK = 'prefork'
+    # A thread per slot in a single process. Conversions mostly wait for ffmpeg and S3,
+    # so they don't compete for the GIL.
+    THREADS = 'threads'
+
+
 class UvicornConfig(BaseModel):
     host: str = '0.0.0.0'
     port: int = 8000
     workers: int = 1
     reload: bool = False
+    # Compress WebSocket frames if the client supports it. Events are small, repetitive JSON.
+    ws_per_message_deflate: bool = True
 
 
 class MongoDBConfig(BaseModel):
@@ -28,6 +57,10 @@ class MongoDBConfig(BaseModel):
 class RedisConfig(BaseModel):
     host: str = 'redis'
     port: int = 6379
+    # Publish events with SPUBLISH/SSUBSCRIBE (Redis 7+). In Redis Cluster a sharded message only
+    # goes to the shard owning the channel, while a classic one is broadcast to every node.
+    # Redis is connected to as a cluster then, with the host as a startup node.
+    sharded_pubsub: bool = False
 
 
 class SQSConfig(BaseModel):
@@ -37,16 +70,87 @@ class SQSConfig(BaseModel):
 class S3Config(BaseModel):
     bucket: str = 'v2g'
     presigned_url_expiry: int = 60 * 60 * 24 * 7
+    # S3 doesn't accept parts smaller than 5 MiB (except the last one).
+    multipart_part_size: int = 8 * 1024 * 1024
+    multipart_concurrency: int = 4
 
 
 class Settings(BaseSettings):
     api_v1_str: str = '/api/v1'
     secret: str = secrets.token_urlsafe(32)
     jwt_lifetime_in_minutes: int = 60 * 24 * 7
+    # The bcrypt cost factor of new hashes. Every increment doubles the time of hashing; existing
+    # hashes keep the cost they were created with.
+    password_hash_rounds: int = 12
+    # Hashing runs in a thread pool of this size, so a burst of logins can't block the event loop
+    # or take up every thread of the process. Calls over the limit wait in a queue.
+    password_hash_concurrency: int = 2
+    # Used when the cost of a conversion is unknown. Otherwise the timeout is estimated by the cost
+    # (the number of pixels to encode) and the conversion is retried with a bigger budget once.
     conversion_process_timeout_in_seconds: int = 60 * 3
+    conversion_min_timeout_in_seconds: int = 30
+    conversion_max_timeout_in_seconds: int = 60 * 60
+    conversion_timeout_per_megapixel_in_seconds: float = 0.1
+    conversion_timeout_escalation_factor: float = 4.0
+    conversion_ingest_mode: ConversionIngestMode = ConversionIngestMode.FILE
+    conversion_ingest_chunk_size: int = 1024 * 1024
+    conversion_probe_timeout_in_seconds: int = 30
+    # At most that many progress events per second are sent for a conversion.
+    conversion_progress_max_rate: float = 1.0
+    # The cost is the number of pixels to encode. The default is about 30 seconds of 720p 25 FPS.
+    conversion_large_queue_min_cost: int = 30 * 25 * 1280 * 720
+    # Videos at least this long are split into segments converted on different workers.
+    conversion_segment_min_duration_in_seconds: int = 60 * 2
+    conversion_segment_duration_in_seconds: int = 30
+    conversion_batch_max_size: int = 50
+    conversion_lookup_max_ids: int = 100
+    conversion_page_max_size: int = 100
+    # The longest a client may wait for a status change when getting a conversion.
+    conversion_wait_max_in_seconds: int = 60
+    # The number of the most recent conversions shown along with the user.
+    user_recent_conversions: int = 10
+    # Source videos are cached on worker hosts, so retries don't download them again.
+    # The max size is in bytes, 0 disables the cache.
+    conversion_source_cache_dir: str = '/tmp/v2g_source_cache'
+    conversion_source_cache_max_size: int = 2 * 1024 * 1024 * 1024
+    # Every running conversion locks a group of cores with a file in this directory.
+    conversion_cpu_lock_dir: str = '/tmp/v2g_cpu'
+
+    # Videos uploaded to S3 directly (see the uploads module).
+    upload_max_size: int = 1024 * 1024 * 1024
+    upload_expiry_in_seconds: int = 60 * 60
+    upload_resumable_expiry_in_seconds: int = 60 * 60 * 24
+    # Resumable uploads are sent in chunks of this size (except the last one), a part each.
+    # S3 doesn't accept parts smaller than 5 MiB.
+    upload_part_size: int = 8 * 1024 * 1024
+    # A chunk being sent holds the offset for this long. If its request dies midway,
+    # the client can resume once the claim has expired.
+    upload_part_claim_in_seconds: int = 60 * 5
+
+    # Recent events of a user are kept for clients to catch up with after reconnecting.
+    events_log_max_length: int = 100
+    events_log_ttl_in_seconds: int = 60 * 60 * 24
+    events_heartbeat_interval_in_seconds: int = 15
+    # Events are dropped for a listener that has that many of them unsent.
+    events_queue_max_size: int = 100
+    # Events of a conversion coming within the window are sent as one (the latest), so bursts of
+    # progress updates don't turn into a frame each. 0 sends every event right away.
+    events_coalesce_window_in_seconds: float = 0.25
 
     rate_limit_enabled: bool = True
+    # Finalized uploads count as conversions too.
     rate_limit_create_conversions: str = '50/day; 10/hour'
+    # Shared by presigned and resumable uploads.
+    rate_limit_create_uploads: str = '50/day; 10/hour'
+    # Limits the requests only. Every video of a batch counts against the conversion limit too.
+    rate_limit_create_conversion_batches: str = '10/day; 2/hour'
+
+    celery_pool: CeleryPool = CeleryPool.PREFORK
+    # 0 means a slot per core, as long as there is celery_memory_per_slot bytes of memory for each.
+    celery_concurrency: int = 0
+    celery_memory_per_slot: int = 512 * 1024 * 1024
+    # Workers serve their metrics on this port if PROMETHEUS_MULTIPROC_DIR is set.
+    celery_metrics_port: int = 8001
 
     log_level: str = 'INFO'
     log_json: bool = False
@@ -67,6 +171,9 @@ class Settings(BaseSettings):
     def get_celery_broker_dsn(self):
         return 'sqs://'
 
+    def get_celery_result_backend_dsn(self):
+        return f'redis://{self.redis.host}:{self.redis.port}/2'
+
     def get_celery_broker_transport_options(self):
         return {
             'region': self.sqs.region,
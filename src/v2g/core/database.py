@@ -1,7 +1,43 @@
+import asyncio
 from typing import Annotated
 
+import structlog
 from fastapi import Depends, Request
-from pymongo import AsyncMongoClient
+from pymongo import ASCENDING, DESCENDING, AsyncMongoClient, IndexModel
+
+from v2g.core.config import settings
+
+logger = structlog.get_logger()
+
+# Every query of the repositories and the tasks should be served by one of these.
+INDEXES = {
+    'users': [
+        IndexModel([('username', ASCENDING)], unique=True),
+    ],
+    'conversions': [
+        # Listing (newest first) and looking up conversions of a user.
+        IndexModel([('owner_id', ASCENDING), ('_id', DESCENDING)]),
+        IndexModel([('owner_id', ASCENDING), ('status', ASCENDING), ('_id', DESCENDING)]),
+        # Monitoring of stuck and failed conversions.
+        IndexModel([('status', ASCENDING), ('_id', DESCENDING)]),
+    ],
+    'conversion_cache': [
+        # Also keeps concurrent upserts of the same video from creating two entries.
+        IndexModel([('content_hash', ASCENDING), ('params', ASCENDING)], unique=True),
+        IndexModel([('gif_file_id', ASCENDING)]),
+    ],
+    'uploads': [
+        # Uploads are dropped a day after they expire, finalized or not.
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=60 * 60 * 24),
+    ],
+}
+
+
+async def ensure_indexes(db):
+    """Create missing indexes. It's cheap if they exist already, so it's done on every start."""
+    for collection_name, indexes in INDEXES.items():
+        names = await db.get_collection(collection_name).create_indexes(indexes)
+        logger.info('Ensured indexes.', collection=collection_name, indexes=names)
 
 
 async def get_mongo_client(request: Request):
@@ -9,3 +45,12 @@ async def get_mongo_client(request: Request):
 
 
 MongoClientDep = Annotated[AsyncMongoClient, Depends(get_mongo_client)]
+
+
+async def _main():
+    async with AsyncMongoClient(host=settings.mongodb.host, port=settings.mongodb.port) as client:
+        await ensure_indexes(client.get_database(settings.mongodb.dbname))
+
+
+if __name__ == '__main__':
+    asyncio.run(_main())
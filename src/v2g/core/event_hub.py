@@ -0,0 +1,176 @@
+import asyncio
+import json
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Annotated
+
+import structlog
+from fastapi import Depends
+from fastapi.requests import HTTPConnection
+from redis.asyncio import RedisError
+from redis.asyncio.cluster import RedisCluster
+
+from v2g.core.config import settings
+from v2g.core.redis import get_events_channel, get_events_log_key, parse_event_id
+
+logger = structlog.get_logger()
+
+# A cluster subscribes to sharded channels on each shard owning one, and the shards are read in
+# turn, waiting up to this long for each.
+SHARD_READ_TIMEOUT_IN_SECONDS = 0.1
+
+# Sent instead of the replay when events after the last one received are no longer in the log.
+# The client should fetch its conversions again.
+RESYNC_EVENT = {'type': 'resync'}
+
+
+class EventHub:
+    """
+    A single Redis subscription per process shared by all local listeners (WebSockets, SSE
+    streams, long polls). A channel is subscribed when its first listener comes and unsubscribed
+    when the last one goes. Messages are fanned out to listeners through asyncio queues.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self._pubsub = redis_client.pubsub()
+        if settings.redis.sharded_pubsub:
+            self._subscribe = self._pubsub.ssubscribe
+            self._unsubscribe = self._pubsub.sunsubscribe
+        else:
+            self._subscribe = self._pubsub.subscribe
+            self._unsubscribe = self._pubsub.unsubscribe
+        # A cluster reads sharded messages from the connection to each shard separately.
+        if settings.redis.sharded_pubsub and isinstance(redis_client, RedisCluster):
+            self._get_message = self._get_sharded_message
+        else:
+            self._get_message = partial(self._pubsub.get_message, timeout=None)
+        self._queues = defaultdict(set)
+        self._confirmations = {}
+        self._lock = asyncio.Lock()
+        self._connected = asyncio.Event()
+        self._reader = None
+
+    async def __aenter__(self):
+        self._reader = asyncio.create_task(self._read())
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._reader.cancel()
+        await asyncio.gather(self._reader, return_exceptions=True)
+        await self._pubsub.aclose()
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        """
+        Yield a queue of messages published to the channel (as strings). Once this returns,
+        Redis has confirmed the subscription, so no later message is missed.
+        """
+        queue = asyncio.Queue(maxsize=settings.events_queue_max_size)
+        async with self._lock:
+            if not self._queues[channel]:
+                self._confirmations[channel] = asyncio.Event()
+                await self._subscribe(channel)
+                self._connected.set()
+            self._queues[channel].add(queue)
+            confirmation = self._confirmations[channel]
+
+        try:
+            await confirmation.wait()
+            yield queue
+        finally:
+            async with self._lock:
+                self._queues[channel].discard(queue)
+                if not self._queues[channel]:
+                    del self._queues[channel]
+                    del self._confirmations[channel]
+                    await self._unsubscribe(channel)
+
+    async def listen(self, user_id, last_event_id=None, idle_timeout=None):
+        """
+        Yield (event id, event) for events of the user's conversions. Events logged after
+        `last_event_id` are replayed first, or RESYNC_EVENT is yielded if some of them may have
+        been trimmed off the log already. None is yielded whenever nothing comes for
+        `idle_timeout` seconds. Progress updates aren't logged and come without an id.
+        """
+        log = logger.bind(user_id=str(user_id))
+        # Subscribed before the replay, so no event is missed in between.
+        async with self.subscribe(get_events_channel(user_id)) as queue:
+            last_seen = parse_event_id(last_event_id) if last_event_id else None
+            if last_seen:
+                log_key = get_events_log_key(user_id)
+                oldest = await self.redis_client.xrange(log_key, count=1)
+                # The event received last is gone, so may be some of the ones after it.
+                if not oldest or parse_event_id(oldest[0][0].decode()) > last_seen:
+                    log.info('Missed events are no longer in the log.')
+                    yield None, dict(RESYNC_EVENT)
+                # The range is exclusive, the client has got that event already.
+                entries = await self.redis_client.xrange(log_key, min=f'({last_event_id}')
+                log.info('Replaying missed events.', count=len(entries))
+                for entry_id, fields in entries:
+                    entry_id = entry_id.decode()
+                    yield entry_id, json.loads(fields[b'data'])
+                    last_seen = parse_event_id(entry_id)
+
+            while True:
+                try:
+                    async with asyncio.timeout(idle_timeout):
+                        message = await queue.get()
+                except TimeoutError:
+                    yield None
+                    continue
+
+                event = json.loads(message)
+                event_id = event.pop('event_id', None)
+                # It could be replayed already.
+                if last_seen and event_id and parse_event_id(event_id) <= last_seen:
+                    continue
+                yield event_id, event
+
+    async def _read(self):
+        # The connection is made by the first subscription.
+        await self._connected.wait()
+        while True:
+            try:
+                message = await self._get_message()
+            except RedisError:
+                logger.exception('Could not read from the event subscription. Reconnecting.')
+                await asyncio.sleep(1)
+                continue
+
+            if message:
+                self._dispatch(message)
+
+    async def _get_sharded_message(self):
+        message = await self._pubsub.get_sharded_message(timeout=SHARD_READ_TIMEOUT_IN_SECONDS)
+        if message is None and not self._queues:
+            # Nothing is subscribed, so there is no shard to wait on.
+            await asyncio.sleep(SHARD_READ_TIMEOUT_IN_SECONDS)
+        return message
+
+    def _dispatch(self, message):
+        channel = message['channel'].decode()
+        if message['type'] in ('subscribe', 'ssubscribe'):
+            confirmation = self._confirmations.get(channel)
+            if confirmation:
+                confirmation.set()
+            return
+
+        if message['type'] not in ('message', 'smessage'):
+            return
+
+        data = message['data'].decode()
+        for queue in self._queues.get(channel, ()):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                # A slow listener doesn't hold up the others. It can catch up from the log.
+                logger.warning('Dropped an event for a slow listener.', channel=channel)
+
+
+async def get_event_hub(connection: HTTPConnection):
+    return connection.state.event_hub
+
+
+EventHubDep = Annotated[EventHub, Depends(get_event_hub)]
@@ -1,11 +1,52 @@
 from typing import Annotated
 
+import redis
 import redis.asyncio as aioredis
-from fastapi import Depends, WebSocket
+from fastapi import Depends
+from fastapi.requests import HTTPConnection
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster
+from redis.cluster import RedisCluster
 
+from v2g.core.config import settings
 
-async def get_redis_client(websocket: WebSocket):
-    return websocket.state.redis_client
+
+def create_redis_client():
+    """
+    A client of the Redis holding events. With sharded pub/sub it's a cluster client, so
+    messages are published on the shard owning the channel. The host is a startup node then.
+    """
+    if settings.redis.sharded_pubsub:
+        return RedisCluster(host=settings.redis.host, port=settings.redis.port)
+    return redis.Redis(host=settings.redis.host, port=settings.redis.port)
+
+
+def create_async_redis_client():
+    """The asyncio version of create_redis_client."""
+    if settings.redis.sharded_pubsub:
+        return AsyncRedisCluster(host=settings.redis.host, port=settings.redis.port)
+    return aioredis.Redis(host=settings.redis.host, port=settings.redis.port)
+
+
+def get_events_channel(user_id):
+    """Events of the user's conversions are published there."""
+    return f'user:{user_id}:events'
+
+
+def get_events_log_key(user_id):
+    """A capped stream of recent events of the user, so clients can catch up after reconnecting."""
+    return f'user:{user_id}:log'
+
+
+def parse_event_id(value):
+    """Return a stream entry id as a tuple of numbers to compare, or None if it isn't one."""
+    ms, _, seq = value.partition('-')
+    if not (ms.isdigit() and seq.isdigit()):
+        return None
+    return int(ms), int(seq)
+
+
+async def get_redis_client(connection: HTTPConnection):
+    return connection.state.redis_client
 
 
 RedisClientDep = Annotated[aioredis.Redis, Depends(get_redis_client)]
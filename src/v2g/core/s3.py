@@ -1,3 +1,6 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Annotated, Any
 
 from fastapi import Depends, Request
@@ -8,3 +11,165 @@ async def get_s3_client(request: Request) -> Any:
 
 
 S3ClientDep = Annotated[Any, Depends(get_s3_client)]
+
+
+class MultipartUpload:
+    """
+    Upload a stream of unknown length to S3 while it is still being produced.
+
+    Parts are uploaded in parallel by a thread pool. At most `concurrency` parts are kept
+    in memory, so writing blocks while all upload slots are busy. The upload is aborted
+    when the context is left without calling `complete`.
+    """
+
+    def __init__(self, s3_client, *, part_size, concurrency, **create_params):
+        self.s3_client = s3_client
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.create_params = create_params
+        self.params = {'Bucket': create_params['Bucket'], 'Key': create_params['Key']}
+        self.size = 0
+        self.completed = False
+
+        self._buffer = bytearray()
+        self._futures = []
+        self._error = None
+
+    def __enter__(self):
+        response = self.s3_client.create_multipart_upload(**self.create_params)
+        self.params['UploadId'] = response['UploadId']
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.completed:
+            self.abort()
+
+    def write(self, data):
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._submit(bytes(self._buffer[: self.part_size]))
+            del self._buffer[: self.part_size]
+
+    def copy_from(self, stream):
+        while chunk := stream.read(self.part_size):
+            self.write(chunk)
+
+    def complete(self):
+        # S3 expects at least one part. Only the last one may be smaller than 5 MiB.
+        if self._buffer or not self._futures:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+
+        parts = [future.result() for future in self._futures]
+        self._executor.shutdown()
+        self.s3_client.complete_multipart_upload(
+            **self.params,
+            MultipartUpload={'Parts': parts},
+        )
+        self.completed = True
+
+    def abort(self):
+        self._executor.shutdown(cancel_futures=True)
+        self.s3_client.abort_multipart_upload(**self.params)
+
+    def _submit(self, data):
+        self._slots.acquire()
+        if self._error:
+            self._slots.release()
+            raise self._error
+
+        part_number = len(self._futures) + 1
+        future = self._executor.submit(self._upload_part, part_number, data)
+        future.add_done_callback(self._on_part_done)
+        self._futures.append(future)
+
+    def _upload_part(self, part_number, data):
+        response = self.s3_client.upload_part(**self.params, PartNumber=part_number, Body=data)
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def _on_part_done(self, future):
+        if not future.cancelled() and future.exception():
+            self._error = future.exception()
+        self._slots.release()
+
+
+class AsyncMultipartUpload:
+    """
+    The asyncio counterpart of MultipartUpload for aioboto3 clients.
+    Parts are uploaded by concurrent tasks, at most `concurrency` of them at once.
+    """
+
+    def __init__(self, s3_client, *, part_size, concurrency, **create_params):
+        self.s3_client = s3_client
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.create_params = create_params
+        self.params = {'Bucket': create_params['Bucket'], 'Key': create_params['Key']}
+        self.size = 0
+        self.completed = False
+
+        self._buffer = bytearray()
+        self._tasks = []
+        self._error = None
+
+    async def __aenter__(self):
+        response = await self.s3_client.create_multipart_upload(**self.create_params)
+        self.params['UploadId'] = response['UploadId']
+        self._slots = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if not self.completed:
+            await self.abort()
+
+    async def write(self, data):
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            await self._submit(bytes(self._buffer[: self.part_size]))
+            del self._buffer[: self.part_size]
+
+    async def complete(self):
+        # S3 expects at least one part. Only the last one may be smaller than 5 MiB.
+        if self._buffer or not self._tasks:
+            await self._submit(bytes(self._buffer))
+            self._buffer.clear()
+
+        parts = await asyncio.gather(*self._tasks)
+        await self.s3_client.complete_multipart_upload(
+            **self.params,
+            MultipartUpload={'Parts': parts},
+        )
+        self.completed = True
+
+    async def abort(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.s3_client.abort_multipart_upload(**self.params)
+
+    async def _submit(self, data):
+        await self._slots.acquire()
+        if self._error:
+            self._slots.release()
+            raise self._error
+
+        part_number = len(self._tasks) + 1
+        self._tasks.append(asyncio.create_task(self._upload_part(part_number, data)))
+
+    async def _upload_part(self, part_number, data):
+        try:
+            response = await self.s3_client.upload_part(
+                **self.params,
+                PartNumber=part_number,
+                Body=data,
+            )
+        except Exception as exc:
+            self._error = exc
+            raise
+        finally:
+            self._slots.release()
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
@@ -1,16 +1,29 @@
+import asyncio
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 from typing import Annotated
 
 import jwt
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
+from prometheus_client import Gauge
 
 from v2g.core.config import settings
 
 JWT_ALGORITHM = 'HS256'
 
-pwd_context = CryptContext(schemes=['bcrypt'])
+pwd_context = CryptContext(schemes=['bcrypt'], bcrypt__rounds=settings.password_hash_rounds)
+password_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.password_hash_concurrency,
+    thread_name_prefix='password-hash',
+)
+
+PASSWORD_HASH_QUEUE_SIZE = Gauge(
+    'password_hash_queue_size',
+    'Password hashes and verifications waiting for a thread',
+    multiprocess_mode='livesum',
+)
 
 reusable_oauth2 = OAuth2PasswordBearer(tokenUrl=f'{settings.api_v1_str}/auth/access-token/')
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
@@ -36,9 +49,30 @@ def parse_token(token):
         return False, None
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def _start_password_hash(func, *args):
+    PASSWORD_HASH_QUEUE_SIZE.dec()
+    return func(*args)
+
+
+async def _run_password_hash(func, *args):
+    """
+    Run bcrypt in the password hash pool. It takes hundreds of milliseconds of CPU,
+    which would stall every other request of the process if run on the event loop.
+    """
+    PASSWORD_HASH_QUEUE_SIZE.inc()
+    future = password_hash_executor.submit(_start_password_hash, func, *args)
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        # It's still counted as queued if it never started.
+        if future.cancel():
+            PASSWORD_HASH_QUEUE_SIZE.dec()
+        raise
+
+
+async def verify_password(plain_password, hashed_password):
+    return await _run_password_hash(pwd_context.verify, plain_password, hashed_password)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await _run_password_hash(pwd_context.hash, password)
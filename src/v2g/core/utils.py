@@ -8,6 +8,8 @@ _error_responses = {
     401: {'model': ErrorResponse, 'description': 'Could not authorize. No token was provided.'},
     403: {'model': ErrorResponse, 'description': 'Could not authorize. Provided token is invalid.'},
     404: {'model': ErrorResponse, 'description': 'Not found.'},
+    409: {'model': ErrorResponse, 'description': 'Conflicts with the state of the resource.'},
+    429: {'model': ErrorResponse, 'description': 'Too many requests. The rate limit is exceeded.'},
 }
 
 
@@ -0,0 +1,210 @@
+import json
+import os
+import signal
+import subprocess
+import threading
+from fractions import Fraction
+
+import structlog
+
+from v2g.core.config import settings
+
+logger = structlog.get_logger()
+
+
+def kill_process_group(popen):
+    """
+    Kill a process started with start_new_session=True along with anything it has spawned.
+    Killing only the process itself may leave its children running.
+    """
+    if popen.poll() is not None:
+        return
+    try:
+        os.killpg(popen.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def feed_stdin(popen, chunks):
+    """
+    Write chunks into the stdin of an ffmpeg process and close it when they run out.
+    Meant to be run in a separate thread, so ffmpeg starts before the whole input is read.
+    """
+    try:
+        for chunk in chunks:
+            popen.stdin.write(chunk)
+    except (BrokenPipeError, ValueError):
+        # ffmpeg exited before consuming the whole input (it failed or was killed).
+        pass
+    except Exception:
+        # Otherwise ffmpeg would take a truncated input for a complete one.
+        logger.exception('Could not read the input stream. Killing ffmpeg.')
+        kill_process_group(popen)
+    finally:
+        try:
+            popen.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def read_progress(stream, callback):
+    """
+    Parse the output of `ffmpeg -progress` and call back with the position in the output
+    (in seconds) and the encoding speed relative to real time (None if unknown) on every update.
+    Meant to be run in a separate thread, it stops when ffmpeg closes the stream.
+    """
+    fields = {}
+    with stream:
+        for line in stream:
+            key, _, value = line.decode().strip().partition('=')
+            fields[key] = value
+            if key != 'progress':
+                continue
+
+            try:
+                out_time = int(fields['out_time_us']) / 1_000_000
+            except (KeyError, ValueError):
+                out_time = None
+            try:
+                speed = float(fields.get('speed', '').rstrip('x'))
+            except ValueError:
+                speed = None
+            fields = {}
+
+            if out_time is None:
+                continue
+            try:
+                callback(out_time, speed)
+            except Exception:
+                logger.exception('Could not handle progress of ffmpeg.')
+
+
+def wait_process(popen):
+    """
+    Wait for a process and return its exit code and the CPU time it used in seconds
+    (user and system). The CPU time is None if the process was reaped by someone else.
+    """
+    try:
+        _, status, rusage = os.wait4(popen.pid, 0)
+    except ChildProcessError:
+        return popen.wait(), None
+
+    popen.returncode = os.waitstatus_to_exitcode(status)
+    return popen.returncode, rusage.ru_utime + rusage.ru_stime
+
+
+class ProcessDeadline:
+    """
+    Kill a process group if it is still running when the timeout expires, or when the context
+    is left, e.g. because of an exception. The process is always reaped on exit.
+    Unlike Popen.wait(timeout=...), it doesn't require the caller to block on the process,
+    so the caller may consume the process output meanwhile.
+    """
+
+    def __init__(self, popen, timeout):
+        self.popen = popen
+        self.timeout = timeout
+        self.expired = False
+        self._timer = threading.Timer(timeout, self._expire)
+
+    def __enter__(self):
+        self._timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._timer.cancel()
+        kill_process_group(self.popen)
+        self.popen.wait()
+
+    def _expire(self):
+        if self.popen.poll() is None:
+            self.expired = True
+            kill_process_group(self.popen)
+
+
+def _run_ffprobe(args):
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', *args],
+            capture_output=True,
+            timeout=settings.conversion_probe_timeout_in_seconds,
+        )
+    except subprocess.TimeoutExpired:
+        logger.error('ffprobe timed out.')
+        return None
+
+    if result.returncode != 0:
+        logger.error('ffprobe failed.', exit_code=result.returncode, stderr=result.stderr.decode())
+        return None
+
+    return result.stdout.decode()
+
+
+def _parse_frame_rate(value):
+    try:
+        return float(Fraction(value))
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def probe_video(input_arg):
+    """
+    Return the metadata of the first video stream of a media file, or None if there is none.
+    The start time and the duration are in seconds.
+    """
+    entries = 'format=start_time,duration:stream=codec_name,width,height,avg_frame_rate'
+    output = _run_ffprobe(
+        ['-select_streams', 'v:0', '-show_entries', entries, '-of', 'json', input_arg]
+    )
+    if output is None:
+        return None
+
+    data = json.loads(output)
+    streams = data.get('streams')
+    if not streams:
+        return None
+
+    stream = streams[0]
+    format_ = data.get('format', {})
+    try:
+        return {
+            'start_time': float(format_.get('start_time', 0)),
+            'duration': float(format_['duration']),
+            'width': int(stream['width']),
+            'height': int(stream['height']),
+            'fps': _parse_frame_rate(stream.get('avg_frame_rate')),
+            'codec': stream.get('codec_name'),
+        }
+    except (KeyError, ValueError):
+        return None
+
+
+def probe_keyframes(input_arg, start_time=0.0):
+    """
+    Return timestamps of the video keyframes relative to the start time.
+    Packets are only demuxed, not decoded, so it's much cheaper than the conversion itself.
+    """
+    entries = ['-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0']
+    output = _run_ffprobe(['-select_streams', 'v:0', *entries, input_arg])
+    if output is None:
+        return []
+
+    keyframes = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if flags.startswith('K') and pts_time != 'N/A':
+            keyframes.append(float(pts_time) - start_time)
+    return sorted(keyframes)
+
+
+def split_at_keyframes(keyframes, duration, segment_duration):
+    """
+    Split a video into time ranges of at least `segment_duration` seconds (except the last one).
+    Every range starts at a keyframe, so it can be decoded without the preceding ones.
+    """
+    bounds = [0.0]
+    for keyframe in keyframes:
+        if keyframe - bounds[-1] >= segment_duration and keyframe < duration:
+            bounds.append(keyframe)
+    bounds.append(duration)
+    return list(zip(bounds, bounds[1:]))
@@ -0,0 +1,92 @@
+EXTENSION_INTRODUCER = 0x21
+IMAGE_SEPARATOR = 0x2C
+TRAILER = 0x3B
+APPLICATION_EXTENSION_LABEL = 0xFF
+
+COLOR_TABLE_FLAG = 0x80
+COLOR_TABLE_SIZE_MASK = 0x07
+
+# The header ("GIF89a") and the logical screen descriptor.
+HEADER_SIZE = 13
+IMAGE_DESCRIPTOR_SIZE = 9
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError('Unexpected end of a GIF stream.')
+    return data
+
+
+def _read_color_table(stream, packed):
+    if not packed & COLOR_TABLE_FLAG:
+        return None
+    return _read_exactly(stream, 3 * 2 ** ((packed & COLOR_TABLE_SIZE_MASK) + 1))
+
+
+def _read_sub_blocks(stream):
+    """Read data sub-blocks including the block terminator."""
+    chunks = []
+    while True:
+        size = _read_exactly(stream, 1)
+        chunks.append(size)
+        if size[0] == 0:
+            return b''.join(chunks)
+        chunks.append(_read_exactly(stream, size[0]))
+
+
+def concat_gifs(sources, write):
+    """
+    Join GIF streams into one animation. Frames follow in the order of the sources.
+
+    The logical screen and the loop settings are taken from the first stream. Frames relying on
+    a global color table other than the first stream's get their table as a local one, so the
+    streams don't have to share a palette to be joined correctly (though it's cheaper if they do).
+    """
+    first_color_table = None
+
+    for index, source in enumerate(sources):
+        header = _read_exactly(source, HEADER_SIZE)
+        screen_packed = header[10]
+        color_table = _read_color_table(source, screen_packed)
+
+        if index == 0:
+            write(header)
+            if color_table:
+                write(color_table)
+            first_color_table = color_table
+
+        while True:
+            introducer = _read_exactly(source, 1)
+            if introducer[0] == TRAILER:
+                break
+
+            if introducer[0] == EXTENSION_INTRODUCER:
+                label = _read_exactly(source, 1)
+                data = _read_sub_blocks(source)
+                # The application extension carries the loop settings of the whole animation.
+                if index == 0 or label[0] != APPLICATION_EXTENSION_LABEL:
+                    write(introducer + label + data)
+
+            elif introducer[0] == IMAGE_SEPARATOR:
+                descriptor = bytearray(_read_exactly(source, IMAGE_DESCRIPTOR_SIZE))
+                image_packed = descriptor[8]
+                local_color_table = _read_color_table(source, image_packed)
+                if local_color_table is None and color_table != first_color_table:
+                    local_color_table = color_table
+                    descriptor[8] = (
+                        (image_packed & ~COLOR_TABLE_SIZE_MASK)
+                        | COLOR_TABLE_FLAG
+                        | (screen_packed & COLOR_TABLE_SIZE_MASK)
+                    )
+
+                write(introducer + descriptor)
+                if local_color_table:
+                    write(local_color_table)
+                # The LZW minimum code size and the image data.
+                write(_read_exactly(source, 1) + _read_sub_blocks(source))
+
+            else:
+                raise ValueError(f'Unexpected GIF block: {introducer.hex()}.')
+
+    write(bytes([TRAILER]))
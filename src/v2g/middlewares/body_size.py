@@ -0,0 +1,39 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+DETAIL = 'The request body is too large.'
+
+
+class BodySizeLimitMiddleware:
+    """
+    Reject requests with a body larger than `max_size` bytes. The declared Content-Length
+    is checked up front, and the body is counted while it's being received, so a request
+    is cut off before it's spooled to disk as a whole.
+    """
+
+    def __init__(self, app, max_size):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope['headers'])
+        content_length = headers.get(b'content-length')
+        if content_length and content_length.isdigit() and int(content_length) > self.max_size:
+            response = JSONResponse({'detail': DETAIL}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_size:
+                    raise HTTPException(status_code=413, detail=DETAIL)
+            return message
+
+        return await self.app(scope, receive_limited, send)
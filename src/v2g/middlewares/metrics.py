@@ -1,3 +1,5 @@
+import os
+import re
 import time
 
 from fastapi import Request, Response
@@ -83,3 +85,40 @@ def metrics_route(_: Request):
         status_code=200,
         headers={'Content-Type': CONTENT_TYPE_LATEST},
     )
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def mark_worker_dead(pid):
+    """
+    Drop the live gauges (multiprocess_mode='live*') of an API worker, which would otherwise keep
+    counting in the sum after it's gone. uvicorn has no hook for a worker exit, so a worker calls
+    this for itself when shutting down.
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+
+def mark_crashed_workers_dead():
+    """Drop the live gauges of workers that exited without shutting down (e.g. were killed)."""
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if not path:
+        return
+
+    pids = set()
+    for filename in os.listdir(path):
+        match = re.fullmatch(r'gauge_live\w+_(\d+)\.db', filename)
+        if match:
+            pids.add(int(match[1]))
+
+    for pid in pids:
+        if not _is_process_alive(pid):
+            mark_worker_dead(pid)
@@ -1,5 +1,7 @@
 from enum import StrEnum
 
+from pydantic import Field
+
 from v2g.core.models import BaseSchema, TypeObjectId
 
 
@@ -15,17 +17,38 @@ TERMINAL_CONVERSION_STATUSES = {
     ConversionStatus.FAILED,
 }
 
+# Everything that affects the output of a conversion. Conversions of the same video with the same
+# parameters share one GIF.
+CONVERSION_PARAMS = {'format': 'gif'}
+
+
+class ConversionProgress(BaseSchema):
+    percent: float
+    eta_in_seconds: float | None = None
+
 
 class ConversionPublic(BaseSchema):
     id: str
     gif_url: str | None = None
     webhook_url: str | None
     status: ConversionStatus = ConversionStatus.PENDING
+    progress: ConversionProgress | None = None
 
     class Config:
         title = 'Conversion'
 
 
+class ConversionPage(BaseSchema):
+    items: list[ConversionPublic]
+    next_after: str | None = Field(
+        default=None,
+        description='Pass it as `after` to get the next page. Null on the last page.',
+    )
+
+    class Config:
+        title = 'Conversion page'
+
+
 class ConversionWebhookBody(BaseSchema):
     id: TypeObjectId
     video_file_id: TypeObjectId
@@ -1,15 +1,28 @@
+import hashlib
 import mimetypes
 from typing import Annotated
 
 import bson
 from fastapi import Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ReturnDocument
 
 from v2g.core.config import settings
 from v2g.core.database import MongoClientDep
 from v2g.core.repository import BaseRepository
-from v2g.core.s3 import S3ClientDep
+from v2g.core.s3 import AsyncMultipartUpload, S3ClientDep
 
-from .models import ConversionPublic, ConversionStatus
+from .models import CONVERSION_PARAMS, ConversionPublic, ConversionStatus
+
+# Only the fields ConversionPublic is built from.
+PUBLIC_PROJECTION = {'gif_url': 1, 'webhook_url': 1, 'status': 1, 'progress': 1}
+
+
+def read_and_hash(file, size, digest):
+    """Read a chunk of the file and feed it to the digest, so the file is read only once."""
+    chunk = file.read(size)
+    digest.update(chunk)
+    return chunk
 
 
 class ConversionRepository(BaseRepository):
@@ -20,7 +33,10 @@ class ConversionRepository(BaseRepository):
     def get_conversions_collection(self):
         return self.get_database().get_collection('conversions')
 
-    async def get(self, id_=None, owner_id=None, many=False):
+    def get_cache_collection(self):
+        return self.get_database().get_collection('conversion_cache')
+
+    async def get(self, id_=None, owner_id=None):
         conversions_coll = self.get_conversions_collection()
 
         params = {}
@@ -29,42 +45,127 @@ class ConversionRepository(BaseRepository):
         if owner_id:
             params['owner_id'] = owner_id
 
-        if many:
-            return (
-                self._convert_mongo_conversion_to_public(x)
-                async for x in conversions_coll.find(params)
-            )
+        conversion = await conversions_coll.find_one(params)
+        if conversion:
+            return self._convert_mongo_conversion_to_public(conversion)
         else:
-            conversion = await conversions_coll.find_one(params)
-            if conversion:
-                return self._convert_mongo_conversion_to_public(conversion)
-            else:
-                return None
+            return None
 
-    async def create(self, file, content_type, owner_id, webhook_url=None):
-        video_file_id = bson.ObjectId()
-        s3key = str(video_file_id)
-        await self.s3_client.put_object(
-            Bucket=settings.s3.bucket,
-            Key=s3key,
-            Body=file,
-            ContentType=content_type,
-            Metadata={'owner-id': str(owner_id)},
+    async def get_page(
+        self,
+        owner_id,
+        *,
+        limit,
+        after=None,
+        status=None,
+        created_after=None,
+        created_before=None,
+    ):
+        """
+        Return a page of conversions, newest first, and the id to get the next page after
+        (None if it's the last page). Pages are keyed by the id, which also holds the creation
+        time, so a page costs the same however deep it is.
+        """
+        id_filter = {}
+        upper_bounds = [after]
+        if created_before:
+            upper_bounds.append(bson.ObjectId.from_datetime(created_before))
+        upper_bounds = [x for x in upper_bounds if x]
+        if upper_bounds:
+            id_filter['$lt'] = min(upper_bounds)
+        if created_after:
+            id_filter['$gte'] = bson.ObjectId.from_datetime(created_after)
+
+        params = {'owner_id': owner_id}
+        if id_filter:
+            params['_id'] = id_filter
+        if status:
+            params['status'] = status
+
+        conversions_coll = self.get_conversions_collection()
+        cursor = (
+            conversions_coll.find(params, projection=PUBLIC_PROJECTION)
+            .sort('_id', -1)
+            .limit(limit + 1)
         )
+        conversions = [self._convert_mongo_conversion_to_public(x) async for x in cursor]
 
+        next_after = None
+        if len(conversions) > limit:
+            conversions = conversions[:limit]
+            next_after = conversions[-1].id
+        return conversions, next_after
+
+    async def get_many(self, ids, owner_id):
+        """Return conversions in the order of the ids. Unknown ids are skipped."""
+        conversions_coll = self.get_conversions_collection()
+        cursor = conversions_coll.find(
+            {'_id': {'$in': ids}, 'owner_id': owner_id},
+            projection=PUBLIC_PROJECTION,
+        )
+        conversions = {x['_id']: x async for x in cursor}
+        return [
+            self._convert_mongo_conversion_to_public(conversions[x])
+            for x in dict.fromkeys(ids)
+            if x in conversions
+        ]
+
+    async def create(self, file, content_type, owner_id, webhook_url=None):
+        conversion = await self._prepare(file, content_type, owner_id, webhook_url)
+        conversions_coll = self.get_conversions_collection()
+        try:
+            result = await conversions_coll.insert_one(conversion)
+        except Exception:
+            await self._discard(conversion)
+            raise
+        conversion['_id'] = result.inserted_id
+        return conversion
+
+    async def create_many(self, files, owner_id, webhook_url=None):
+        """
+        Create conversions of (file, content type) pairs with a single insert. If any of them
+        fails, the files of the others are released, so none is left behind.
+        """
+        conversions = []
+        conversions_coll = self.get_conversions_collection()
+        try:
+            for file, content_type in files:
+                conversions.append(await self._prepare(file, content_type, owner_id, webhook_url))
+            result = await conversions_coll.insert_many(conversions)
+        except Exception:
+            await self._discard(*conversions)
+            raise
+        for conversion, inserted_id in zip(conversions, result.inserted_ids):
+            conversion['_id'] = inserted_id
+        return conversions
+
+    async def create_for_uploaded_video(self, id_, video_file_id, owner_id, webhook_url=None):
+        """
+        Create a conversion of a video uploaded to S3 directly. The API never sees the content,
+        so there is no hash to look the GIF up in the cache by.
+        """
         conversion = {
+            '_id': id_,
             'owner_id': owner_id,
+            'content_hash': None,
             'video_file_id': video_file_id,
             'gif_file_id': None,
             'gif_url': None,
             'webhook_url': webhook_url,
             'status': ConversionStatus.PENDING,
         }
+        conversions_coll = self.get_conversions_collection()
+        await conversions_coll.insert_one(conversion)
+        return conversion
 
+    async def delete(self, id_, owner_id):
         conversions_coll = self.get_conversions_collection()
-        result = await conversions_coll.insert_one(conversion)
-        conversion_id = result.inserted_id
-        return conversion_id
+        conversion = await conversions_coll.find_one_and_delete({'_id': id_, 'owner_id': owner_id})
+        if not conversion:
+            return False
+
+        await self._release_files(conversion)
+        return True
 
     def calc_mimetype(self, file_mimetype, filename):
         prefix = 'video/'
@@ -79,6 +180,138 @@ class ConversionRepository(BaseRepository):
 
         return None
 
+    async def _prepare(self, file, content_type, owner_id, webhook_url):
+        """Upload the video unless its GIF is cached, and return a conversion to insert."""
+        video_file_id = bson.ObjectId()
+        content_hash, cached = await self._upload_video(file, video_file_id, content_type, owner_id)
+        conversion = {
+            'owner_id': owner_id,
+            'content_hash': content_hash,
+            'video_file_id': video_file_id,
+            'gif_file_id': None,
+            'gif_url': None,
+            'webhook_url': webhook_url,
+            'status': ConversionStatus.PENDING,
+        }
+
+        if cached:
+            # The same video has been converted before. Neither the upload nor the conversion
+            # is needed.
+            conversion.update(
+                video_file_id=cached['video_file_id'],
+                gif_file_id=cached['gif_file_id'],
+                status=ConversionStatus.DONE,
+            )
+            try:
+                conversion['gif_url'] = await self._generate_presigned_url(cached['gif_file_id'])
+            except Exception:
+                await self._release_files(conversion)
+                raise
+
+        return conversion
+
+    async def _upload_video(self, file, video_file_id, content_type, owner_id):
+        """
+        Upload a video unless its GIF is cached, hashing it from the chunks being uploaded.
+        Return the hash and the acquired cache entry (None if the video was uploaded).
+
+        A video fitting into a single part is looked up before it's uploaded, so a cache hit
+        skips the upload. Larger ones are uploaded in parts in parallel as they are read, and the
+        parts are discarded on a cache hit.
+        """
+        params = {
+            'Bucket': settings.s3.bucket,
+            'Key': str(video_file_id),
+            'ContentType': content_type,
+            'Metadata': {'owner-id': str(owner_id)},
+        }
+        part_size = settings.s3.multipart_part_size
+        digest = hashlib.sha256()
+
+        chunk = await run_in_threadpool(read_and_hash, file, part_size, digest)
+        if len(chunk) < part_size:
+            cached = await self._acquire_cached_gif(digest.hexdigest())
+            if not cached:
+                await self.s3_client.put_object(**params, Body=chunk)
+            return digest.hexdigest(), cached
+
+        cached = None
+        try:
+            async with AsyncMultipartUpload(
+                self.s3_client,
+                part_size=part_size,
+                concurrency=settings.s3.multipart_concurrency,
+                **params,
+            ) as upload:
+                while chunk:
+                    await upload.write(chunk)
+                    chunk = await run_in_threadpool(read_and_hash, file, part_size, digest)
+
+                cached = await self._acquire_cached_gif(digest.hexdigest())
+                # Otherwise the upload is aborted on exit.
+                if not cached:
+                    await upload.complete()
+        except Exception:
+            if cached:
+                await self._release_files(cached)
+            raise
+        return digest.hexdigest(), cached
+
+    async def _acquire_cached_gif(self, content_hash):
+        cache_coll = self.get_cache_collection()
+        return await cache_coll.find_one_and_update(
+            {'content_hash': content_hash, 'params': CONVERSION_PARAMS},
+            {'$inc': {'refcount': 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _discard(self, *conversions):
+        """Undo _prepare() of conversions that could not be inserted."""
+        # The driver sets the ids before inserting, a failed insert may have written some.
+        ids = [x['_id'] for x in conversions if '_id' in x]
+        if ids:
+            conversions_coll = self.get_conversions_collection()
+            await conversions_coll.delete_many({'_id': {'$in': ids}})
+        for conversion in conversions:
+            await self._release_files(conversion)
+
+    async def _release_files(self, conversion):
+        """
+        Delete the files of a conversion unless they are shared with other conversions.
+        Conversions of the same video hold a reference to one cache entry, the last one
+        to go deletes the files.
+        """
+        gif_file_id = conversion.get('gif_file_id')
+        file_ids = [x for x in (conversion['video_file_id'], gif_file_id) if x]
+
+        if gif_file_id:
+            cache_coll = self.get_cache_collection()
+            entry = await cache_coll.find_one_and_update(
+                {'gif_file_id': gif_file_id},
+                {'$inc': {'refcount': -1}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if entry:
+                if entry['refcount'] > 0:
+                    return
+
+                # The entry could be acquired again in the meantime.
+                filter_ = {'_id': entry['_id'], 'refcount': {'$lte': 0}}
+                if not await cache_coll.find_one_and_delete(filter_):
+                    return
+
+        await self.s3_client.delete_objects(
+            Bucket=settings.s3.bucket,
+            Delete={'Objects': [{'Key': str(x)} for x in file_ids]},
+        )
+
+    async def _generate_presigned_url(self, file_id):
+        return await self.s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': settings.s3.bucket, 'Key': str(file_id)},
+            ExpiresIn=settings.s3.presigned_url_expiry,
+        )
+
     def _convert_mongo_conversion_to_public(self, data):
         return ConversionPublic.model_validate(
             {
@@ -1,28 +1,63 @@
+import asyncio
+import datetime
+import json
+from contextlib import suppress
 from typing import Annotated
 
-from fastapi import APIRouter, Form, HTTPException, Request, UploadFile
+from fastapi import APIRouter, Form, HTTPException, Query, Request, UploadFile
 from pydantic import HttpUrl
 
 from v2g.core.config import settings
+from v2g.core.event_hub import EventHubDep
 from v2g.core.models import TypeObjectId
+from v2g.core.redis import get_events_channel
 from v2g.core.utils import create_error_responses
 from v2g.modules.users.dependencies import CurrentUserIDDep
-from v2g.rate_limiter import limiter
-from v2g.tasks import convert_video_to_gif
+from v2g.rate_limiter import CREATE_CONVERSIONS_SCOPE, charge_rate_limit, limiter
+from v2g.tasks import (
+    probe_video_for_conversion,
+    probe_videos_for_conversions,
+    send_webhook_conversion_done,
+)
 
-from .models import ConversionPublic, ConversionStatus
+from .models import (
+    TERMINAL_CONVERSION_STATUSES,
+    ConversionPage,
+    ConversionPublic,
+    ConversionStatus,
+)
 from .repositories import ConversionRepositoryDep
 
 router = APIRouter()
 
 
+async def _wait_for_status_change(queue, conversion_id, status, timeout):
+    """Return once an event reports another status of the conversion or the timeout passes."""
+    with suppress(TimeoutError):
+        async with asyncio.timeout(timeout):
+            while True:
+                event = json.loads(await queue.get())
+                # Progress events don't change the status.
+                if event['conversion_id'] == conversion_id and event['status'] != status:
+                    return
+
+
+def _convert_conversion_to_response(conversion):
+    return {
+        'id': str(conversion['_id']),
+        'gif_url': conversion['gif_url'],
+        'webhook_url': conversion['webhook_url'],
+        'status': conversion['status'],
+    }
+
+
 @router.post(
     path='/',
     response_model=ConversionPublic,
     summary='Run new conversion',
     responses=create_error_responses({400}, add_token_related_errors=True),
 )
-@limiter.limit(settings.rate_limit_create_conversions)
+@limiter.shared_limit(settings.rate_limit_create_conversions, scope=CREATE_CONVERSIONS_SCOPE)
 async def convert_video(
     *,
     file: UploadFile,
@@ -38,20 +73,125 @@ async def convert_video(
         raise HTTPException(status_code=400, detail='Invalid media type. Expected video/*')
 
     webhook_url = webhook_url and webhook_url.unicode_string()
-    conversion_bson_id = await conversion_repo.create(
+    conversion = await conversion_repo.create(
         file.file,
         content_type,
         current_user_id,
         webhook_url=webhook_url,
     )
-    conversion_id = str(conversion_bson_id)
-    convert_video_to_gif.delay(conversion_id)
-    return {
-        'id': conversion_id,
-        'gif_url': None,
-        'webhook_url': webhook_url,
-        'status': ConversionStatus.PENDING,
-    }
+    conversion_id = str(conversion['_id'])
+    if conversion['status'] == ConversionStatus.PENDING:
+        # The conversion is scheduled once the video is probed.
+        probe_video_for_conversion.delay(conversion_id)
+    elif webhook_url:
+        # The GIF was taken from the cache, so the conversion is done already.
+        send_webhook_conversion_done.delay(conversion_id)
+
+    return _convert_conversion_to_response(conversion)
+
+
+@router.post(
+    path='/batch/',
+    response_model=list[ConversionPublic],
+    summary='Run new conversions in a batch',
+    responses=create_error_responses({400, 429}, add_token_related_errors=True),
+)
+@limiter.limit(settings.rate_limit_create_conversion_batches)
+async def convert_videos(
+    *,
+    files: list[UploadFile],
+    webhook_url: Annotated[HttpUrl | None, Form()] = None,
+    request: Request,
+    current_user_id: CurrentUserIDDep,
+    conversion_repo: ConversionRepositoryDep,
+):
+    """
+    The webhook is called for every conversion of the batch. Every video counts against
+    the limit of conversions as if it were sent alone.
+    """
+    max_size = settings.conversion_batch_max_size
+    if len(files) > max_size:
+        raise HTTPException(status_code=400, detail=f'At most {max_size} videos are accepted.')
+
+    items = []
+    for file in files:
+        content_type = conversion_repo.calc_mimetype(file.content_type, file.filename)
+        if not content_type:
+            raise HTTPException(
+                status_code=400,
+                detail=f'Invalid media type of {file.filename}. Expected video/*',
+            )
+        items.append((file.file, content_type))
+
+    charge_rate_limit(
+        request,
+        settings.rate_limit_create_conversions,
+        CREATE_CONVERSIONS_SCOPE,
+        cost=len(items),
+    )
+
+    webhook_url = webhook_url and webhook_url.unicode_string()
+    conversions = await conversion_repo.create_many(
+        items,
+        current_user_id,
+        webhook_url=webhook_url,
+    )
+
+    pending_ids = []
+    for conversion in conversions:
+        conversion_id = str(conversion['_id'])
+        if conversion['status'] == ConversionStatus.PENDING:
+            pending_ids.append(conversion_id)
+        elif webhook_url:
+            send_webhook_conversion_done.delay(conversion_id)
+
+    if pending_ids:
+        probe_videos_for_conversions.delay(pending_ids)
+
+    return [_convert_conversion_to_response(x) for x in conversions]
+
+
+@router.get(
+    path='/',
+    response_model=ConversionPage,
+    summary='List my conversions',
+    responses=create_error_responses(set(), add_token_related_errors=True),
+)
+async def list_conversions(
+    current_user_id: CurrentUserIDDep,
+    conversion_repo: ConversionRepositoryDep,
+    status: ConversionStatus | None = None,
+    created_after: datetime.datetime | None = None,
+    created_before: datetime.datetime | None = None,
+    after: TypeObjectId | None = None,
+    limit: Annotated[int, Query(ge=1, le=settings.conversion_page_max_size)] = 20,
+):
+    """The newest conversions go first. Times without a timezone are taken as UTC."""
+    conversions, next_after = await conversion_repo.get_page(
+        current_user_id,
+        limit=limit,
+        after=after,
+        status=status,
+        created_after=created_after,
+        created_before=created_before,
+    )
+    return {'items': conversions, 'next_after': next_after}
+
+
+# Must go before '/{conversion_id}/', otherwise 'batch' is taken for an id.
+@router.get(
+    path='/batch/',
+    response_model=list[ConversionPublic],
+    summary='Get info of many conversions',
+    responses=create_error_responses(set(), add_token_related_errors=True),
+)
+async def get_conversions_batch(
+    ids: Annotated[list[TypeObjectId], Query(max_length=settings.conversion_lookup_max_ids)],
+    current_user_id: CurrentUserIDDep,
+    conversion_repo: ConversionRepositoryDep,
+):
+    """Conversions that don't exist or belong to another user are left out."""
+    return await conversion_repo.get_many(ids, current_user_id)
 
 
 @router.get(
@@ -64,9 +204,53 @@ async def get_conversion(
     conversion_id: TypeObjectId,
     current_user_id: CurrentUserIDDep,
     conversion_repo: ConversionRepositoryDep,
+    event_hub: EventHubDep,
+    wait: Annotated[int, Query(ge=0, le=settings.conversion_wait_max_in_seconds)] = 0,
 ):
+    """
+    With `wait`, the response is held until the status of an unfinished conversion changes
+    or that many seconds pass. Then the conversion is returned as usual.
+    """
+    if not wait:
+        conversion = await conversion_repo.get(id_=conversion_id, owner_id=current_user_id)
+        if not conversion:
+            raise HTTPException(status_code=404)
+        return conversion
+
+    # Subscribed before reading the conversion, so no event is missed in between.
+    async with event_hub.subscribe(get_events_channel(current_user_id)) as queue:
+        conversion = await conversion_repo.get(id_=conversion_id, owner_id=current_user_id)
+        if not conversion:
+            raise HTTPException(status_code=404)
+        if conversion.status in TERMINAL_CONVERSION_STATUSES:
+            return conversion
+
+        await _wait_for_status_change(queue, conversion.id, conversion.status, wait)
+
+    # It could be deleted in the meantime.
     conversion = await conversion_repo.get(id_=conversion_id, owner_id=current_user_id)
     if not conversion:
         raise HTTPException(status_code=404)
-
     return conversion
+
+
+@router.delete(
+    path='/{conversion_id}/',
+    status_code=204,
+    summary='Delete conversion',
+    responses=create_error_responses({400, 404}, add_token_related_errors=True),
+)
+async def delete_conversion(
+    conversion_id: TypeObjectId,
+    current_user_id: CurrentUserIDDep,
+    conversion_repo: ConversionRepositoryDep,
+):
+    conversion = await conversion_repo.get(id_=conversion_id, owner_id=current_user_id)
+    if not conversion:
+        raise HTTPException(status_code=404)
+
+    if conversion.status not in TERMINAL_CONVERSION_STATUSES:
+        raise HTTPException(status_code=400, detail='The conversion is still in progress.')
+
+    if not await conversion_repo.delete(conversion_id, current_user_id):
+        raise HTTPException(status_code=404)
@@ -0,0 +1,63 @@
+import json
+from contextlib import aclosing
+from typing import Annotated
+
+from fastapi import APIRouter, Header
+from fastapi.responses import StreamingResponse
+
+from v2g.core.config import settings
+from v2g.core.event_hub import EventHubDep
+from v2g.core.utils import create_error_responses
+from v2g.modules.users.dependencies import CurrentUserIDDep
+
+router = APIRouter()
+
+
+def _format_event(event_id, data):
+    # Without an id the browser keeps the last one, to be sent back when reconnecting.
+    if event_id is None:
+        return f'data: {data}\n\n'
+    return f'id: {event_id}\ndata: {data}\n\n'
+
+
+async def _stream_events(event_hub, user_id, last_event_id):
+    events = event_hub.listen(
+        user_id,
+        last_event_id,
+        idle_timeout=settings.events_heartbeat_interval_in_seconds,
+    )
+    async with aclosing(events):
+        async for item in events:
+            if item is None:
+                # Keeps proxies from closing an idle connection.
+                yield ': heartbeat\n\n'
+                continue
+            event_id, event = item
+            yield _format_event(event_id, json.dumps(event))
+
+
+@router.get(
+    path='/',
+    summary='Stream events of my conversions',
+    response_class=StreamingResponse,
+    responses={
+        200: {'content': {'text/event-stream': {}}},
+        **create_error_responses(set(), add_token_related_errors=True),
+    },
+)
+async def stream_events(
+    current_user_id: CurrentUserIDDep,
+    event_hub: EventHubDep,
+    last_event_id: Annotated[str | None, Header()] = None,
+):
+    """
+    Server-Sent Events carrying the same messages as the WebSocket. After reconnecting,
+    events missed since `Last-Event-ID` are sent first; if they are no longer kept,
+    `{"type": "resync"}` is sent instead and the conversions should be fetched again.
+    """
+    return StreamingResponse(
+        _stream_events(event_hub, current_user_id, last_event_id),
+        media_type='text/event-stream',
+        # Otherwise nginx holds events back to fill its buffer.
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
@@ -0,0 +1,40 @@
+from datetime import datetime
+from enum import StrEnum
+
+from pydantic import Field, HttpUrl
+
+from v2g.core.models import BaseSchema
+
+
+class UploadStatus(StrEnum):
+    PENDING = 'pending'
+    FINALIZED = 'finalized'
+
+
+class UploadCreate(BaseSchema):
+    content_type: str
+    size: int = Field(gt=0, description='The exact size of the video in bytes.')
+    filename: str | None = None
+    webhook_url: HttpUrl | None = None
+
+
+class UploadPublic(BaseSchema):
+    id: str
+    url: str = Field(description='Send the video there as a multipart/form-data POST request.')
+    fields: dict[str, str] = Field(description='Form fields to send along with the video.')
+    expires_at: datetime
+
+    class Config:
+        title = 'Upload'
+
+
+class ResumableUploadPublic(BaseSchema):
+    id: str
+    status: UploadStatus
+    size: int
+    offset: int = Field(description='The number of bytes uploaded. Send the next chunk from there.')
+    part_size: int = Field(description='Every chunk except the last one must be that large.')
+    expires_at: datetime
+
+    class Config:
+        title = 'Resumable upload'
@@ -0,0 +1,214 @@
+import datetime
+from typing import Annotated
+
+import bson
+from botocore.exceptions import ClientError
+from fastapi import Depends, Request
+from pymongo import ReturnDocument
+
+from v2g.core.config import settings
+from v2g.core.database import MongoClientDep
+from v2g.core.repository import BaseRepository
+from v2g.core.s3 import S3ClientDep
+
+from .models import UploadStatus
+
+
+def _fix_timezone(upload):
+    # Mongo gives back naive datetimes, though they are in UTC.
+    if upload:
+        upload['expires_at'] = upload['expires_at'].replace(tzinfo=datetime.UTC)
+    return upload
+
+
+class UploadRepository(BaseRepository):
+    def __init__(self, *, s3_client, **kwargs):
+        super().__init__(**kwargs)
+        self.s3_client = s3_client
+
+    def get_uploads_collection(self):
+        return self.get_database().get_collection('uploads')
+
+    async def get(self, id_, owner_id):
+        uploads_coll = self.get_uploads_collection()
+        upload = await uploads_coll.find_one({'_id': id_, 'owner_id': owner_id})
+        return _fix_timezone(upload)
+
+    async def create(self, owner_id, content_type, size, webhook_url=None):
+        """
+        Register an upload and return it along with a presigned POST request. S3 rejects
+        the request unless the video has exactly the declared size and content type.
+        """
+        video_file_id = bson.ObjectId()
+        expiry = settings.upload_expiry_in_seconds
+        owner_meta = str(owner_id)
+        presigned_post = await self.s3_client.generate_presigned_post(
+            Bucket=settings.s3.bucket,
+            Key=str(video_file_id),
+            Fields={'Content-Type': content_type, 'x-amz-meta-owner-id': owner_meta},
+            Conditions=[
+                ['content-length-range', size, size],
+                {'Content-Type': content_type},
+                {'x-amz-meta-owner-id': owner_meta},
+            ],
+            ExpiresIn=expiry,
+        )
+
+        upload = await self._insert(
+            owner_id,
+            video_file_id,
+            content_type,
+            size,
+            webhook_url=webhook_url,
+            expiry=expiry,
+        )
+        return upload, presigned_post
+
+    async def create_resumable(self, owner_id, content_type, size, webhook_url=None):
+        """
+        Register an upload sent through the API in chunks, one S3 multipart upload part each.
+        If a chunk fails, the client resumes from the offset the upload has reached.
+        """
+        video_file_id = bson.ObjectId()
+        multipart_upload = await self.s3_client.create_multipart_upload(
+            Bucket=settings.s3.bucket,
+            Key=str(video_file_id),
+            ContentType=content_type,
+            Metadata={'owner-id': str(owner_id)},
+        )
+        return await self._insert(
+            owner_id,
+            video_file_id,
+            content_type,
+            size,
+            webhook_url=webhook_url,
+            expiry=settings.upload_resumable_expiry_in_seconds,
+            multipart_upload_id=multipart_upload['UploadId'],
+            part_size=settings.upload_part_size,
+            offset=0,
+            parts=[],
+            claim=None,
+        )
+
+    async def append(self, upload, offset, data):
+        """
+        Upload a chunk starting at the offset as the next part. Return the updated upload,
+        or None if the offset isn't where the upload stopped or another request is sending
+        a chunk there.
+
+        The offset is claimed before the part is uploaded, so concurrent requests can't
+        overwrite each other's part while only one of them gets its ETag stored.
+        """
+        uploads_coll = self.get_uploads_collection()
+        claim_id = bson.ObjectId()
+        now = datetime.datetime.now(datetime.UTC)
+        claim_expires_at = now + datetime.timedelta(seconds=settings.upload_part_claim_in_seconds)
+        claimed = await uploads_coll.update_one(
+            {
+                '_id': upload['_id'],
+                'status': UploadStatus.PENDING,
+                'offset': offset,
+                '$or': [{'claim': None}, {'claim.expires_at': {'$lt': now}}],
+            },
+            {'$set': {'claim': {'id': claim_id, 'expires_at': claim_expires_at}}},
+        )
+        if not claimed.modified_count:
+            return None
+
+        part_number = offset // upload['part_size'] + 1
+        try:
+            part = await self.s3_client.upload_part(
+                Bucket=settings.s3.bucket,
+                Key=str(upload['video_file_id']),
+                UploadId=upload['multipart_upload_id'],
+                PartNumber=part_number,
+                Body=data,
+            )
+        except Exception:
+            # Let the client retry right away rather than after the claim expires.
+            await uploads_coll.update_one(
+                {'_id': upload['_id'], 'claim.id': claim_id},
+                {'$set': {'claim': None}},
+            )
+            raise
+
+        upload = await uploads_coll.find_one_and_update(
+            {'_id': upload['_id'], 'status': UploadStatus.PENDING, 'claim.id': claim_id},
+            {
+                '$set': {'offset': offset + len(data), 'claim': None},
+                '$push': {'parts': {'PartNumber': part_number, 'ETag': part['ETag']}},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        return _fix_timezone(upload)
+
+    async def is_uploaded(self, upload):
+        if upload.get('multipart_upload_id'):
+            if upload['offset'] != upload['size']:
+                return False
+            await self._complete_multipart_upload(upload)
+
+        try:
+            head = await self.s3_client.head_object(
+                Bucket=settings.s3.bucket,
+                Key=str(upload['video_file_id']),
+            )
+        except ClientError:
+            return False
+
+        return head['ContentLength'] == upload['size']
+
+    async def _insert(
+        self, owner_id, video_file_id, content_type, size, *, webhook_url, expiry, **extra
+    ):
+        upload = {
+            'owner_id': owner_id,
+            'video_file_id': video_file_id,
+            'content_type': content_type,
+            'size': size,
+            'webhook_url': webhook_url,
+            'status': UploadStatus.PENDING,
+            'conversion_id': None,
+            'expires_at': datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds=expiry),
+            **extra,
+        }
+        uploads_coll = self.get_uploads_collection()
+        result = await uploads_coll.insert_one(upload)
+        upload['_id'] = result.inserted_id
+        return upload
+
+    async def _complete_multipart_upload(self, upload):
+        try:
+            await self.s3_client.complete_multipart_upload(
+                Bucket=settings.s3.bucket,
+                Key=str(upload['video_file_id']),
+                UploadId=upload['multipart_upload_id'],
+                MultipartUpload={'Parts': upload['parts']},
+            )
+        except ClientError as exc:
+            # A previous attempt to finalize the upload has completed it already.
+            if exc.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+
+    async def finalize(self, id_, owner_id, conversion_id):
+        """
+        Bind the upload to a conversion. Return None if it's finalized already,
+        so a video is never converted twice.
+        """
+        uploads_coll = self.get_uploads_collection()
+        return await uploads_coll.find_one_and_update(
+            {'_id': id_, 'owner_id': owner_id, 'status': UploadStatus.PENDING},
+            {'$set': {'status': UploadStatus.FINALIZED, 'conversion_id': conversion_id}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+
+async def get_upload_repository(
+    request: Request,
+    mongo_client: MongoClientDep,
+    s3_client: S3ClientDep,
+):
+    return UploadRepository(request=request, mongo_client=mongo_client, s3_client=s3_client)
+
+
+UploadRepositoryDep = Annotated[UploadRepository, Depends(get_upload_repository)]
@@ -0,0 +1,233 @@
+import datetime
+from typing import Annotated
+
+import bson
+from fastapi import APIRouter, HTTPException, Query, Request
+
+from v2g.core.config import settings
+from v2g.core.models import TypeObjectId
+from v2g.core.utils import create_error_responses
+from v2g.modules.conversions.models import ConversionPublic
+from v2g.modules.conversions.repositories import ConversionRepositoryDep
+from v2g.modules.users.dependencies import CurrentUserIDDep
+from v2g.rate_limiter import (
+    CREATE_CONVERSIONS_SCOPE,
+    CREATE_UPLOADS_SCOPE,
+    charge_rate_limit,
+    limiter,
+)
+from v2g.tasks import probe_video_for_conversion
+
+from .models import ResumableUploadPublic, UploadCreate, UploadPublic, UploadStatus
+from .repositories import UploadRepositoryDep
+
+router = APIRouter()
+
+
+def _validate_upload_create(create_data, conversion_repo):
+    content_type = conversion_repo.calc_mimetype(create_data.content_type, create_data.filename)
+    if not content_type:
+        raise HTTPException(status_code=400, detail='Invalid media type. Expected video/*')
+
+    if create_data.size > settings.upload_max_size:
+        raise HTTPException(status_code=400, detail='The video is too large.')
+
+    return content_type
+
+
+def _convert_resumable_upload_to_public(upload):
+    return {
+        'id': str(upload['_id']),
+        'status': upload['status'],
+        'size': upload['size'],
+        'offset': upload['offset'],
+        'part_size': upload['part_size'],
+        'expires_at': upload['expires_at'],
+    }
+
+
+async def _read_body(request, max_size):
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_size:
+            raise HTTPException(status_code=400, detail='The chunk is too large.')
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+@router.post(
+    path='/',
+    response_model=UploadPublic,
+    summary='Start uploading a video to convert',
+    responses=create_error_responses({400}, add_token_related_errors=True),
+)
+@limiter.shared_limit(settings.rate_limit_create_uploads, scope=CREATE_UPLOADS_SCOPE)
+async def create_upload(
+    *,
+    create_data: UploadCreate,
+    request: Request,
+    current_user_id: CurrentUserIDDep,
+    upload_repo: UploadRepositoryDep,
+    conversion_repo: ConversionRepositoryDep,
+):
+    """
+    The video goes to the storage directly, bypassing the API. Once it's there,
+    finalize the upload to run the conversion.
+    """
+    content_type = _validate_upload_create(create_data, conversion_repo)
+    webhook_url = create_data.webhook_url and create_data.webhook_url.unicode_string()
+    upload, presigned_post = await upload_repo.create(
+        current_user_id,
+        content_type,
+        create_data.size,
+        webhook_url=webhook_url,
+    )
+    return {
+        'id': str(upload['_id']),
+        'url': presigned_post['url'],
+        'fields': presigned_post['fields'],
+        'expires_at': upload['expires_at'],
+    }
+
+
+@router.post(
+    path='/resumable/',
+    response_model=ResumableUploadPublic,
+    summary='Start uploading a video in chunks',
+    responses=create_error_responses({400}, add_token_related_errors=True),
+)
+@limiter.shared_limit(settings.rate_limit_create_uploads, scope=CREATE_UPLOADS_SCOPE)
+async def create_resumable_upload(
+    *,
+    create_data: UploadCreate,
+    request: Request,
+    current_user_id: CurrentUserIDDep,
+    upload_repo: UploadRepositoryDep,
+    conversion_repo: ConversionRepositoryDep,
+):
+    """
+    Send the video in chunks of `part_size` bytes. If a chunk fails, get the upload
+    to find out the offset to resume from. Once all chunks are sent, finalize the upload
+    to run the conversion.
+    """
+    content_type = _validate_upload_create(create_data, conversion_repo)
+    webhook_url = create_data.webhook_url and create_data.webhook_url.unicode_string()
+    upload = await upload_repo.create_resumable(
+        current_user_id,
+        content_type,
+        create_data.size,
+        webhook_url=webhook_url,
+    )
+    return _convert_resumable_upload_to_public(upload)
+
+
+@router.get(
+    path='/resumable/{upload_id}/',
+    response_model=ResumableUploadPublic,
+    summary='Get resumable upload info',
+    responses=create_error_responses({404}, add_token_related_errors=True),
+)
+async def get_resumable_upload(
+    upload_id: TypeObjectId,
+    current_user_id: CurrentUserIDDep,
+    upload_repo: UploadRepositoryDep,
+):
+    upload = await upload_repo.get(upload_id, current_user_id)
+    if not upload or not upload.get('multipart_upload_id'):
+        raise HTTPException(status_code=404)
+
+    return _convert_resumable_upload_to_public(upload)
+
+
+@router.put(
+    path='/resumable/{upload_id}/',
+    response_model=ResumableUploadPublic,
+    summary='Send the next chunk of a video',
+    responses=create_error_responses({400, 404, 409}, add_token_related_errors=True),
+)
+async def append_to_resumable_upload(
+    upload_id: TypeObjectId,
+    offset: Annotated[int, Query(ge=0)],
+    request: Request,
+    current_user_id: CurrentUserIDDep,
+    upload_repo: UploadRepositoryDep,
+):
+    upload = await upload_repo.get(upload_id, current_user_id)
+    if not upload or not upload.get('multipart_upload_id'):
+        raise HTTPException(status_code=404)
+
+    if upload['status'] != UploadStatus.PENDING:
+        raise HTTPException(status_code=400, detail='The upload is finalized already.')
+
+    if upload['expires_at'] < datetime.datetime.now(datetime.UTC):
+        raise HTTPException(status_code=400, detail='The upload has expired.')
+
+    if upload['offset'] >= upload['size']:
+        raise HTTPException(status_code=409, detail='The video has been uploaded completely.')
+
+    if offset != upload['offset']:
+        raise HTTPException(status_code=409, detail='The offset is not where the upload stopped.')
+
+    part_size = upload['part_size']
+    data = await _read_body(request, part_size)
+    if not data:
+        raise HTTPException(status_code=400, detail='The chunk is empty.')
+    # Only the last chunk may be smaller than a part.
+    if len(data) != min(part_size, upload['size'] - offset):
+        raise HTTPException(status_code=400, detail=f'The chunk must be {part_size} bytes long.')
+
+    upload = await upload_repo.append(upload, offset, data)
+    if not upload:
+        raise HTTPException(status_code=409, detail='The offset is not where the upload stopped.')
+
+    return _convert_resumable_upload_to_public(upload)
+
+
+@router.post(
+    path='/{upload_id}/finalize/',
+    response_model=ConversionPublic,
+    summary='Run the conversion of an uploaded video',
+    responses=create_error_responses({400, 404, 429}, add_token_related_errors=True),
+)
+async def finalize_upload(
+    upload_id: TypeObjectId,
+    request: Request,
+    current_user_id: CurrentUserIDDep,
+    upload_repo: UploadRepositoryDep,
+    conversion_repo: ConversionRepositoryDep,
+):
+    upload = await upload_repo.get(upload_id, current_user_id)
+    if not upload:
+        raise HTTPException(status_code=404)
+
+    if upload['status'] != UploadStatus.PENDING:
+        raise HTTPException(status_code=400, detail='The upload is finalized already.')
+
+    if not await upload_repo.is_uploaded(upload):
+        raise HTTPException(status_code=400, detail='The video has not been uploaded yet.')
+
+    # Counted like a conversion created directly, so uploads don't bypass the limit.
+    charge_rate_limit(
+        request, settings.rate_limit_create_conversions, CREATE_CONVERSIONS_SCOPE, cost=1
+    )
+
+    conversion_id = bson.ObjectId()
+    if not await upload_repo.finalize(upload_id, current_user_id, conversion_id):
+        raise HTTPException(status_code=400, detail='The upload is finalized already.')
+
+    conversion = await conversion_repo.create_for_uploaded_video(
+        conversion_id,
+        upload['video_file_id'],
+        current_user_id,
+        webhook_url=upload['webhook_url'],
+    )
+    probe_video_for_conversion.delay(str(conversion_id))
+
+    return {
+        'id': str(conversion_id),
+        'gif_url': None,
+        'webhook_url': conversion['webhook_url'],
+        'status': conversion['status'],
+    }
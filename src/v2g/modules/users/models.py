@@ -1,7 +1,7 @@
 from pydantic import Field
 
 from v2g.core.models import BaseSchema, TypeObjectId
-from v2g.modules.conversions.models import ConversionPublic
+from v2g.modules.conversions.models import ConversionPublic, ConversionStatus
 
 
 class User(BaseSchema):
@@ -27,7 +27,13 @@ class UserPublic(BaseSchema):
         serialization_alias='id',
     )
     username: str
-    conversions: list[ConversionPublic]
+    conversions: list[ConversionPublic] = Field(
+        description='The most recent conversions. Use GET /conversions/ to see all of them.',
+    )
+    conversion_counts: dict[ConversionStatus, int] = Field(
+        default_factory=dict,
+        description='The number of conversions by status.',
+    )
 
     class Config:
         title = 'User'
@@ -1,6 +1,7 @@
 from typing import Annotated
 
 from fastapi import Depends, Request
+from pymongo.errors import DuplicateKeyError
 
 from v2g.core.database import MongoClientDep
 from v2g.core.repository import BaseRepository
@@ -23,17 +24,87 @@ class UserRepository(BaseRepository):
         user = await users_coll.find_one({'username': username})
         return user and User(**user)
 
+    async def get_profile(self, id_, recent_conversions):
+        """
+        Return the user with its most recent conversions and the number of conversions by
+        status in a single query. The document is shaped like UserPublic, so it can be sent
+        to the client as is.
+        """
+        users_coll = self.get_users_collection()
+        cursor = await users_coll.aggregate(
+            [
+                {'$match': {'_id': id_}},
+                {
+                    '$lookup': {
+                        'from': 'conversions',
+                        'localField': '_id',
+                        'foreignField': 'owner_id',
+                        'pipeline': [
+                            {'$sort': {'_id': -1}},
+                            {'$limit': recent_conversions},
+                            {
+                                '$project': {
+                                    '_id': 0,
+                                    'id': {'$toString': '$_id'},
+                                    'gif_url': {'$ifNull': ['$gif_url', None]},
+                                    'webhook_url': {'$ifNull': ['$webhook_url', None]},
+                                    'status': 1,
+                                    'progress': {'$ifNull': ['$progress', None]},
+                                }
+                            },
+                        ],
+                        'as': 'conversions',
+                    }
+                },
+                {
+                    '$lookup': {
+                        'from': 'conversions',
+                        'localField': '_id',
+                        'foreignField': 'owner_id',
+                        'pipeline': [{'$group': {'_id': '$status', 'count': {'$sum': 1}}}],
+                        'as': 'conversion_counts',
+                    }
+                },
+                {
+                    '$project': {
+                        '_id': 0,
+                        'id': {'$toString': '$_id'},
+                        'username': 1,
+                        'conversions': 1,
+                        'conversion_counts': {
+                            '$arrayToObject': {
+                                '$map': {
+                                    'input': '$conversion_counts',
+                                    'in': {'k': '$$this._id', 'v': '$$this.count'},
+                                }
+                            }
+                        },
+                    }
+                },
+            ]
+        )
+        return await anext(cursor, None)
+
     async def create(self, username, password):
+        """Return the id of the new user, or None if the username is taken."""
         users_coll = self.get_users_collection()
+        # Hashing is expensive, so it's skipped for a username that is taken already.
+        # The unique index still catches sign-ups racing for the same username.
+        if await users_coll.find_one({'username': username}, projection={'_id': 1}):
+            return None
+
         create_values = {
             'username': username,
-            'password': get_password_hash(password),
+            'password': await get_password_hash(password),
         }
-        result = await users_coll.insert_one(create_values)
+        try:
+            result = await users_coll.insert_one(create_values)
+        except DuplicateKeyError:
+            return None
         return result.inserted_id
 
     async def verify_password(self, user, password):
-        return verify_password(password, user.password)
+        return await verify_password(password, user.password)
 
 
 async def get_user_repository(request: Request, mongo_client: MongoClientDep):
@@ -0,0 +1,29 @@
+import bson
+from pydantic import Field
+
+from v2g.core.config import settings
+from v2g.core.models import BaseSchema, TypeObjectId
+from v2g.modules.conversions.models import ConversionStatus
+
+
+class EventFilter(BaseSchema):
+    """
+    Sent by a client over the socket to receive only some events. A missing field matches
+    everything. Progress updates are events with the processing status.
+    """
+
+    conversion_ids: set[TypeObjectId] | None = Field(
+        default=None,
+        max_length=settings.conversion_lookup_max_ids,
+    )
+    statuses: set[ConversionStatus] | None = None
+
+    def matches(self, event):
+        if self.statuses is not None and event.get('status') not in self.statuses:
+            return False
+        if self.conversion_ids is not None:
+            conversion_id = event.get('conversion_id')
+            if not bson.ObjectId.is_valid(conversion_id):
+                return False
+            return bson.ObjectId(conversion_id) in self.conversion_ids
+        return True
@@ -1,54 +1,114 @@
 import asyncio
+import json
 
 import structlog
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from redis.asyncio import RedisError
+from pydantic import ValidationError
 
-from v2g.core.redis import RedisClientDep
+from v2g.core.config import settings
+from v2g.core.event_hub import RESYNC_EVENT, EventHubDep
 from v2g.modules.users.dependencies import WsCurrentUserIDDep
 
+from .models import EventFilter
+
 logger = structlog.get_logger()
 router = APIRouter()
 
 
+def _parse_event_filter(message):
+    """Return the filter sent by the client and None, or None and the errors."""
+    if message.get('text') is None:
+        return None, [{'type': 'frame_type', 'loc': [], 'msg': 'Expected a text frame.'}]
+    try:
+        return EventFilter.model_validate_json(message['text']), None
+    except ValidationError as e:
+        return None, e.errors(include_url=False, include_context=False)
+
+
 @router.websocket('/ws/')
 async def client_ws(
     websocket: WebSocket,
     current_user_id: WsCurrentUserIDDep,
-    redis_client: RedisClientDep,
+    event_hub: EventHubDep,
+    last_event_id: str | None = None,
 ):
+    """
+    Events of my conversions. Every event but progress updates carries its `event_id`; pass
+    the last one received as `last_event_id` when reconnecting to get the events missed
+    meanwhile first. If they are no longer kept, `{"type": "resync"}` is sent instead and the
+    conversions should be fetched again.
+
+    Send an EventFilter as JSON to receive only some events; it is confirmed with
+    `{"filter": ...}`. Events of a conversion coming in quick succession are sent as the latest one.
+    """
     await websocket.accept()
 
     log = logger.bind(user_id=str(current_user_id))
-    pubsub = redis_client.pubsub()
-    channel = f'user:{current_user_id}:events'
-
-    async def reader():
-        try:
-            while True:
-                await websocket.receive()
-        except WebSocketDisconnect:
-            log.info('Client disconnected.')
+    loop = asyncio.get_running_loop()
+    event_filter = EventFilter()
+    # Events waiting for the coalescing window to pass, the latest one per conversion.
+    pending = {}
+    flush_at = None
 
-    reader_task = asyncio.create_task(reader())
+    events = event_hub.listen(current_user_id, last_event_id)
+    getter_task = None
+    receiver_task = None
     try:
-        await pubsub.subscribe(channel)
-        while not reader_task.done():
-            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-            if message is None:
-                continue
-            await websocket.send_text(message['data'].decode())
+        while True:
+            getter_task = getter_task or asyncio.create_task(anext(events))
+            receiver_task = receiver_task or asyncio.create_task(websocket.receive())
+            timeout = max(flush_at - loop.time(), 0) if pending else None
+            done, _ = await asyncio.wait(
+                {getter_task, receiver_task},
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+            if receiver_task in done:
+                message = receiver_task.result()
+                receiver_task = None
+                if message['type'] == 'websocket.disconnect':
+                    log.info('Client disconnected.')
+                    break
+                new_filter, errors = _parse_event_filter(message)
+                if errors:
+                    await websocket.send_text(json.dumps({'error': errors}))
+                else:
+                    event_filter = new_filter
+                    await websocket.send_text(
+                        json.dumps({'filter': event_filter.model_dump(mode='json')})
+                    )
+
+            if getter_task in done:
+                event_id, event = getter_task.result()
+                getter_task = None
+                if event == RESYNC_EVENT:
+                    # Not for a conversion, so neither filtered nor coalesced.
+                    await websocket.send_text(json.dumps(event))
+                    continue
+                if event_id:
+                    event = {'event_id': event_id, **event}
+                if event_filter.matches(event):
+                    # Moved to the end, so events go out in the order of their latest update.
+                    pending.pop(event.get('conversion_id'), None)
+                    pending[event.get('conversion_id')] = event
+                    flush_at = flush_at or loop.time() + settings.events_coalesce_window_in_seconds
+
+            if pending and loop.time() >= flush_at:
+                for event in pending.values():
+                    await websocket.send_text(json.dumps(event))
+                pending.clear()
+                flush_at = None
     except WebSocketDisconnect:
-        log.info('Client disconnected during send.')
-    except RedisError:
-        log.exception('Redis error in WebSocket handler.')
+        log.info('Client disconnected.')
     finally:
-        reader_task.cancel()
+        tasks = [task for task in (getter_task, receiver_task) if task]
+        for task in tasks:
+            task.cancel()
+        # The generator can't be closed while a task is still running it.
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await events.aclose()
         try:
             await websocket.close()
         except Exception:
             log.info('Failed to close WebSocket.')
-        try:
-            await pubsub.aclose()
-        except Exception:
-            log.warning('Failed to close pubsub.')
@@ -1,4 +1,5 @@
 from fastapi import HTTPException, Request
+from limits import parse_many
 from slowapi import Limiter
 
 from v2g.core.config import settings
@@ -18,3 +19,26 @@ limiter = Limiter(
     storage_uri=settings.get_rate_limit_dsn(),
     enabled=settings.rate_limit_enabled,
 )
+
+# Conversions created one by one and in batches count against the same limit.
+CREATE_CONVERSIONS_SCOPE = 'create_conversions'
+# Presigned and resumable uploads count against the same limit.
+CREATE_UPLOADS_SCOPE = 'create_uploads'
+
+
+def charge_rate_limit(request: Request, limit_value, scope, cost):
+    """
+    Take `cost` hits at once from limits shared with routes decorated with
+    limiter.shared_limit(scope=...), e.g. a hit per item of a batch.
+    Nothing is taken if any of the limits would be exceeded.
+    """
+    if not limiter.enabled:
+        return
+
+    identifiers = (get_rate_limit_key(request), scope)
+    items = parse_many(limit_value)
+    for item in items:
+        if not limiter.limiter.test(item, *identifiers, cost=cost):
+            raise HTTPException(status_code=429, detail=f'Rate limit exceeded: {item}')
+    for item in items:
+        limiter.limiter.hit(item, *identifiers, cost=cost)
@@ -14,8 +14,9 @@ def setup_prometheus_multiproc_dir():
     """
     Reason: https://prometheus.github.io/client_python/multiprocess/
 
-    Note that we don't call prometheus_client.multiprocess.mark_process_dead(dead_worker_pid).
-    It does nothing since we don't collect metrics of the gauge type.
+    The password hash queue is a live gauge, so workers call
+    prometheus_client.multiprocess.mark_process_dead() for themselves on shutdown
+    and for crashed ones on startup (see v2g.middlewares.metrics).
     """
     env_var_name = 'PROMETHEUS_MULTIPROC_DIR'
 
@@ -53,5 +54,6 @@ if __name__ == '__main__':
         port=settings.uvicorn.port,
         workers=settings.uvicorn.workers,
         reload=settings.uvicorn.reload,
+        ws_per_message_deflate=settings.uvicorn.ws_per_message_deflate,
         log_config=log_config,
     )
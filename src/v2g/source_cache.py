@@ -0,0 +1,100 @@
+import fcntl
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager, suppress
+
+import structlog
+from prometheus_client import Counter
+
+logger = structlog.get_logger()
+
+SOURCE_CACHE_REQUESTS = Counter(
+    'source_cache_requests_total',
+    'Total lookups of source videos in the worker-local cache',
+    ['result'],
+)
+
+SOURCE_CACHE_EVICTIONS = Counter(
+    'source_cache_evictions_total',
+    'Total source videos evicted from the worker-local cache',
+)
+
+
+class SourceCache:
+    """
+    An LRU cache of source videos on the local disk, shared by all worker processes of a host.
+
+    Entries are written into temporary files and hard-linked into place once complete, so nobody
+    ever sees a partial entry. Readers get hard links of their own, which stay valid even if the
+    entry is evicted meanwhile. Eviction is serialized between processes with a lock file.
+    """
+
+    def __init__(self, path, max_size):
+        self.max_size = max_size
+        self._objects_path = os.path.join(path, 'objects')
+        self._tmp_path = os.path.join(path, 'tmp')
+        self._lock_path = os.path.join(path, '.lock')
+
+    def _get_path(self, key):
+        return os.path.join(self._objects_path, key)
+
+    @contextmanager
+    def checkout(self, key):
+        """Yield a path to the cached file, or None if it's not cached."""
+        link = os.path.join(self._tmp_path, uuid.uuid4().hex)
+        try:
+            os.link(self._get_path(key), link)
+        except FileNotFoundError:
+            SOURCE_CACHE_REQUESTS.labels(result='miss').inc()
+            yield None
+            return
+
+        SOURCE_CACHE_REQUESTS.labels(result='hit').inc()
+        # The modification time is shared by all links, and eviction goes by it.
+        os.utime(link)
+        try:
+            yield link
+        finally:
+            with suppress(FileNotFoundError):
+                os.unlink(link)
+
+    @contextmanager
+    def create(self, key):
+        """
+        Yield a temporary file to write a new entry into. Call commit() when the content is
+        complete, otherwise nothing is cached. The file is deleted when the context is left.
+        """
+        os.makedirs(self._objects_path, exist_ok=True)
+        os.makedirs(self._tmp_path, exist_ok=True)
+        with tempfile.NamedTemporaryFile('wb', dir=self._tmp_path) as file:
+            yield file
+
+    def commit(self, key, file):
+        file.flush()
+        try:
+            os.link(file.name, self._get_path(key))
+        except FileExistsError:
+            # Another process cached the same video first. The content is the same.
+            return
+        self._evict()
+
+    def _evict(self):
+        with open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            entries = []
+            for entry in os.scandir(self._objects_path):
+                with suppress(FileNotFoundError):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                with suppress(FileNotFoundError):
+                    os.unlink(path)
+                    SOURCE_CACHE_EVICTIONS.inc()
+                    logger.info('Evicted a source video from the cache.', path=path, size=size)
+                total_size -= size
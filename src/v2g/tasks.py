@@ -1,32 +1,72 @@
 import json
+import os
+import subprocess
 import tempfile
-from subprocess import DEVNULL, Popen, TimeoutExpired
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from subprocess import DEVNULL, PIPE, Popen
 
 import boto3
 import bson
 import httpx
-import redis
 import structlog
 from asgi_correlation_id.extensions.celery import load_correlation_ids
 from botocore.exceptions import ClientError
-from celery import Celery, signals
+from celery import Celery, chord, group, signals
 from celery.exceptions import MaxRetriesExceededError
+from prometheus_client import CollectorRegistry, Histogram, multiprocess, start_http_server
 from pydantic import ValidationError
-from pymongo import MongoClient
-
-from v2g.core.config import settings
+from pymongo import MongoClient, ReturnDocument
+
+from v2g.core.config import ConversionIngestMode, ConversionQueue, settings
+from v2g.core.redis import create_redis_client, get_events_channel, get_events_log_key
+from v2g.core.s3 import MultipartUpload
+from v2g.ffmpeg import (
+    ProcessDeadline,
+    feed_stdin,
+    probe_keyframes,
+    probe_video,
+    read_progress,
+    split_at_keyframes,
+    wait_process,
+)
+from v2g.gif import concat_gifs
 from v2g.logger import configure_logging
-from v2g.modules.conversions.models import ConversionStatus, ConversionWebhookBody
+from v2g.modules.conversions.models import (
+    CONVERSION_PARAMS,
+    ConversionStatus,
+    ConversionWebhookBody,
+)
+from v2g.source_cache import SourceCache
+from v2g.worker import acquire_cpu_budget, get_worker_concurrency
 
 load_correlation_ids()
 
 logger = structlog.get_logger()
 
+FFMPEG_CPU_TIME = Histogram(
+    'ffmpeg_cpu_seconds',
+    'CPU time used by an ffmpeg process in seconds',
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
+
+FFMPEG_CPU_UTILIZATION = Histogram(
+    'ffmpeg_cpu_utilization_ratio',
+    'CPU time used by an ffmpeg process relative to its wall time and thread budget',
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.5),
+)
+
 celery_app = Celery(
     main='v2g_celery',
     broker=settings.get_celery_broker_dsn(),
+    # Results are needed only to join segments of a video converted in parallel (a chord).
+    backend=settings.get_celery_result_backend_dsn(),
 )
 celery_app.conf.broker_transport_options = settings.get_celery_broker_transport_options()
+celery_app.conf.task_ignore_result = True
+celery_app.conf.worker_pool = settings.celery_pool
+celery_app.conf.worker_concurrency = get_worker_concurrency()
 
 mongo_client = MongoClient(
     host=settings.mongodb.host,
@@ -34,19 +74,32 @@ mongo_client = MongoClient(
     connect=False,
 )
 
-redis_client = redis.Redis(
-    host=settings.redis.host,
-    port=settings.redis.port,
-)
+redis_client = create_redis_client()
 
 s3_client = boto3.client('s3')
 
+source_cache = None
+if settings.conversion_source_cache_max_size:
+    source_cache = SourceCache(
+        settings.conversion_source_cache_dir,
+        settings.conversion_source_cache_max_size,
+    )
+
 
 @signals.after_setup_logger.connect
 def on_after_setup_logger(*args, **kwargs):
     configure_logging('v2g_celery')
 
 
+@signals.worker_ready.connect
+def on_worker_ready(*args, **kwargs):
+    # Metrics are written by the pool processes, so they are collected from files.
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(settings.celery_metrics_port, registry=registry)
+
+
 @signals.task_prerun.connect
 def on_task_prerun(sender, task_id, task, **_):
     request = task.request
@@ -68,11 +121,452 @@ def _set_conversion_status(collection, conversion_id, owner_id, status, extra=No
     if extra and 'gif_file_id' in extra:
         message['gif_file_id'] = str(extra['gif_file_id'])
 
-    redis_client.publish(f'user:{owner_id}:events', json.dumps(message))
+    _publish_event(owner_id, message)
+
+
+def _publish_event(owner_id, message, logged=True):
+    """
+    Publish the event, appending it to the user's log first unless `logged` is false. Logged
+    events carry their id in the log, so they can be replayed to clients that missed them.
+    """
+    if logged:
+        log_key = get_events_log_key(owner_id)
+        event_id = redis_client.xadd(
+            log_key,
+            {'data': json.dumps(message)},
+            maxlen=settings.events_log_max_length,
+            approximate=True,
+        )
+        redis_client.expire(log_key, settings.events_log_ttl_in_seconds)
+        message = {'event_id': event_id.decode(), **message}
+
+    if settings.redis.sharded_pubsub:
+        redis_client.spublish(get_events_channel(owner_id), json.dumps(message))
+    else:
+        redis_client.publish(get_events_channel(owner_id), json.dumps(message))
+
+
+class _ProgressReporter:
+    """
+    A callback for ffmpeg.read_progress reporting the progress of the conversion to the owner
+    and storing it in the conversion. Updates coming too often are held back, only the latest
+    of them is kept and sent by flush() once ffmpeg is done, so the final progress isn't lost.
+    """
+
+    def __init__(self, collection, conversion, duration):
+        self.collection = collection
+        self.conversion = conversion
+        self.duration = duration
+        self._min_interval = 1 / settings.conversion_progress_max_rate
+        self._last_reported_at = None
+        self._held_back = None
+
+    def __call__(self, out_time, speed):
+        now = time.monotonic()
+        if self._last_reported_at is not None and now - self._last_reported_at < self._min_interval:
+            self._held_back = (out_time, speed)
+            return
+        self._report(now, out_time, speed)
+
+    def flush(self):
+        if self._held_back:
+            self._report(time.monotonic(), *self._held_back)
+
+    def _report(self, now, out_time, speed):
+        self._held_back = None
+        self._last_reported_at = now
+
+        out_time = min(out_time, self.duration)
+        progress = {
+            'percent': round(out_time / self.duration * 100, 1),
+            'eta_in_seconds': round((self.duration - out_time) / speed, 1) if speed else None,
+        }
+        self.collection.update_one(
+            {'_id': self.conversion['_id']}, {'$set': {'progress': progress}}
+        )
+        _publish_event(
+            self.conversion['owner_id'],
+            {
+                'conversion_id': str(self.conversion['_id']),
+                'status': str(ConversionStatus.PROCESSING),
+                'progress': progress,
+            },
+            # Not logged, so they don't push status events out of the capped log. A missed
+            # update is outdated by the next one anyway.
+            logged=False,
+        )
+
+
+def _make_progress_callback(collection, conversion):
+    """Return a _ProgressReporter of the conversion, or None if its duration is unknown."""
+    metadata = conversion.get('metadata')
+    if not metadata or not metadata['duration']:
+        return None
+    return _ProgressReporter(collection, conversion, metadata['duration'])
+
+
+def _share_gif(db, conversion, gif_file_id):
+    """
+    Put the GIF into the cache, so next conversions of the same video reuse it.
+    If a concurrent conversion of the same video got there first, switch to its files.
+    Return the id of the GIF the conversion should refer to. A retried conversion
+    may call it again, the conversion is counted in the refcount once.
+    """
+    video_file_id = conversion['video_file_id']
+    content_hash = conversion.get('content_hash')
+    if not content_hash:
+        return gif_file_id
+
+    cache_coll = db.get_collection('conversion_cache')
+    conversion_ids = {'$ifNull': ['$conversion_ids', []]}
+    entry = cache_coll.find_one_and_update(
+        {'content_hash': content_hash, 'params': CONVERSION_PARAMS},
+        [
+            {
+                '$set': {
+                    'gif_file_id': {'$ifNull': ['$gif_file_id', gif_file_id]},
+                    'video_file_id': {'$ifNull': ['$video_file_id', video_file_id]},
+                    'refcount': {
+                        '$add': [
+                            {'$ifNull': ['$refcount', 0]},
+                            {'$cond': [{'$in': [conversion['_id'], conversion_ids]}, 0, 1]},
+                        ]
+                    },
+                    # The conversions that shared their GIF, unlike the cache hits.
+                    'conversion_ids': {'$setUnion': [conversion_ids, [conversion['_id']]]},
+                }
+            }
+        ],
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    if entry['gif_file_id'] != gif_file_id:
+        # The video is the cached one already if this is a retry of the conversion that got
+        # its files into the cache.
+        keys = [str(gif_file_id)]
+        if entry['video_file_id'] != video_file_id:
+            keys.append(str(video_file_id))
+        s3_client.delete_objects(
+            Bucket=settings.s3.bucket,
+            Delete={'Objects': [{'Key': x} for x in keys]},
+        )
+        db.get_collection('conversions').update_one(
+            {'_id': conversion['_id']},
+            {'$set': {'video_file_id': entry['video_file_id']}},
+        )
+
+    return entry['gif_file_id']
+
+
+def _tee_to_cache(chunks, video_key, file):
+    for chunk in chunks:
+        file.write(chunk)
+        yield chunk
+    # Only a complete video gets into the cache.
+    source_cache.commit(video_key, file)
+
+
+@contextmanager
+def _open_video_input(video_key, video_object):
+    """
+    Yield an ffmpeg input argument and chunks to feed into ffmpeg's stdin (None if ffmpeg
+    reads the input by itself). The video is never loaded into memory as a whole.
+    It's also put into the source cache, if enabled.
+    """
+    body = video_object['Body']
+    chunks = body.iter_chunks(chunk_size=settings.conversion_ingest_chunk_size)
+    try:
+        with ExitStack() as stack:
+            if source_cache:
+                file_input = stack.enter_context(source_cache.create(video_key))
+            else:
+                file_input = stack.enter_context(tempfile.NamedTemporaryFile('wb'))
+
+            if settings.conversion_ingest_mode == ConversionIngestMode.PIPE:
+                if source_cache:
+                    chunks = _tee_to_cache(chunks, video_key, file_input)
+                yield 'pipe:0', chunks
+                return
+
+            for chunk in chunks:
+                file_input.write(chunk)
+            file_input.flush()
+            if source_cache:
+                source_cache.commit(video_key, file_input)
+            yield file_input.name, None
+    finally:
+        body.close()
+
+
+def _generate_presigned_url(s3_key):
+    return s3_client.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': settings.s3.bucket, 'Key': s3_key},
+        ExpiresIn=settings.s3.presigned_url_expiry,
+    )
+
+
+def _get_segment_key(conversion_id, name):
+    return f'segments/{conversion_id}/{name}'
+
+
+def _delete_segments(conversion_id, segment_count):
+    names = ['palette.png'] + [f'{index}.gif' for index in range(segment_count)]
+    s3_client.delete_objects(
+        Bucket=settings.s3.bucket,
+        Delete={'Objects': [{'Key': _get_segment_key(conversion_id, x)} for x in names]},
+    )
+
+
+def _iter_s3_files(s3_keys):
+    for s3_key in s3_keys:
+        with tempfile.TemporaryFile() as file:
+            s3_client.download_fileobj(settings.s3.bucket, s3_key, file)
+            file.seek(0)
+            yield file
+
+
+def _apply_cpu_budget(command, cores, threads):
+    # Before the input, so it limits the decoder, which does the most of the work.
+    command = [command[0], '-threads', str(threads), '-filter_threads', str(threads), *command[1:]]
+    if cores:
+        command = ['taskset', '--cpu-list', ','.join(map(str, cores)), *command]
+    return command
+
+
+def _report_cpu_time(log, cpu_time, wall_time, cores, threads):
+    utilization = cpu_time / (wall_time * threads) if wall_time else 0
+    FFMPEG_CPU_TIME.observe(cpu_time)
+    FFMPEG_CPU_UTILIZATION.observe(utilization)
+    log.info(
+        'ffmpeg finished.',
+        cpu_time=round(cpu_time, 2),
+        wall_time=round(wall_time, 2),
+        utilization=round(utilization, 2),
+        cores=cores,
+        threads=threads,
+    )
+
+
+def _encode_gif_to_s3(
+    log,
+    command,
+    s3_key,
+    timeout,
+    input_chunks=None,
+    metadata=None,
+    on_progress=None,
+):
+    """
+    Run ffmpeg writing a GIF to stdout and upload the output to S3 while it's being produced.
+    Return the ffmpeg exit code or None if it timed out. The upload is kept only on success.
+    `on_progress` is a _ProgressReporter.
+    """
+    with ExitStack() as stack:
+        cores, threads = stack.enter_context(acquire_cpu_budget())
+        upload = stack.enter_context(
+            MultipartUpload(
+                s3_client,
+                part_size=settings.s3.multipart_part_size,
+                concurrency=settings.s3.multipart_concurrency,
+                Bucket=settings.s3.bucket,
+                Key=s3_key,
+                ContentType='image/gif',
+                Metadata=metadata or {},
+            )
+        )
+
+        # stdout is taken by the GIF, so ffmpeg reports progress into a separate pipe.
+        pass_fds = ()
+        if on_progress:
+            progress_fd, progress_write_fd = os.pipe()
+            # The reader thread closes it once ffmpeg is done, closing it again is a no-op.
+            progress_stream = stack.enter_context(os.fdopen(progress_fd, 'rb'))
+            pass_fds = (progress_write_fd,)
+            command = [
+                command[0],
+                '-nostats',
+                '-progress',
+                f'pipe:{progress_write_fd}',
+                *command[1:],
+            ]
+
+        command = _apply_cpu_budget(command, cores, threads)
+        started_at = time.monotonic()
+        try:
+            popen = Popen(
+                command,
+                stdin=DEVNULL if input_chunks is None else PIPE,
+                stdout=PIPE,
+                stderr=DEVNULL,
+                pass_fds=pass_fds,
+                # A process group of its own, so it can be killed along with its children.
+                start_new_session=True,
+            )
+        finally:
+            for fd in pass_fds:
+                os.close(fd)
+
+        if input_chunks is not None:
+            threading.Thread(target=feed_stdin, args=(popen, input_chunks), daemon=True).start()
+
+        progress_reader = None
+        if on_progress:
+            progress_reader = threading.Thread(
+                target=read_progress,
+                args=(progress_stream, on_progress),
+                daemon=True,
+            )
+            progress_reader.start()
+
+        with ProcessDeadline(popen, timeout) as deadline:
+            try:
+                upload.copy_from(popen.stdout)
+            finally:
+                popen.stdout.close()
+            code, cpu_time = wait_process(popen)
+
+        # Otherwise a belated progress event could follow the final status.
+        if progress_reader:
+            progress_reader.join()
+            on_progress.flush()
+
+        if cpu_time is not None:
+            _report_cpu_time(log, cpu_time, time.monotonic() - started_at, cores, threads)
+
+        if deadline.expired:
+            log.error('Conversion timed out.', timeout=timeout)
+            return None
+
+        if code == 0:
+            upload.complete()
+        return code
+
+
+def _retry_or_fail(task, log, collection, conversion_id, owner_id, reason, **options):
+    try:
+        raise task.retry(**options)
+    except MaxRetriesExceededError:
+        log.error(f'Max retries exceeded after {reason}.')
+        _set_conversion_status(collection, conversion_id, owner_id, ConversionStatus.FAILED)
+
+
+def _finish_conversion(log, db, conversion, gif_file_id):
+    conversion_id = conversion['_id']
+    gif_file_id = _share_gif(db, conversion, gif_file_id)
+    gif_url = _generate_presigned_url(str(gif_file_id))
+    _set_conversion_status(
+        db.get_collection('conversions'),
+        conversion_id,
+        conversion['owner_id'],
+        ConversionStatus.DONE,
+        extra={'gif_file_id': gif_file_id, 'gif_url': gif_url},
+    )
+
+    webhook_url = conversion.get('webhook_url')
+    if webhook_url:
+        log.info(
+            'Scheduling a webhook request to notify about conversion completion.',
+            webhook_url=webhook_url,
+        )
+        send_webhook_conversion_done.delay(str(conversion_id))
+
+
+def _estimate_conversion_cost(metadata, duration=None):
+    """Return the number of pixels to encode, or None if the video wasn't probed."""
+    if not metadata:
+        return None
+
+    if duration is None:
+        duration = metadata['duration']
+    # GIFs don't need more than that, so it's a fair guess if the frame rate is unknown.
+    fps = metadata['fps'] or 25
+    return duration * fps * metadata['width'] * metadata['height']
+
+
+def _get_conversion_queue(metadata, duration=None):
+    cost = _estimate_conversion_cost(metadata, duration)
+    if cost is not None and cost < settings.conversion_large_queue_min_cost:
+        return ConversionQueue.SMALL
+    return ConversionQueue.LARGE
+
+
+def _get_conversion_timeout(metadata, duration=None, escalated=False):
+    """
+    Estimate the time a conversion needs by its cost. A conversion that timed out once
+    gets a few times more on the second attempt.
+    """
+    cost = _estimate_conversion_cost(metadata, duration)
+    if cost is None:
+        timeout = settings.conversion_process_timeout_in_seconds
+    else:
+        timeout = max(
+            settings.conversion_min_timeout_in_seconds,
+            cost / 1_000_000 * settings.conversion_timeout_per_megapixel_in_seconds,
+        )
+
+    if escalated:
+        timeout *= settings.conversion_timeout_escalation_factor
+    return min(timeout, settings.conversion_max_timeout_in_seconds)
+
+
+def _can_escalate(timeout, escalated):
+    # Another attempt with the same budget would most likely time out again.
+    return not escalated and timeout < settings.conversion_max_timeout_in_seconds
+
+
+def _plan_segments(conversion, video_url):
+    """Return time ranges of a long video to convert in parallel, or an empty list."""
+    metadata = conversion.get('metadata')
+    if not metadata or metadata['duration'] < settings.conversion_segment_min_duration_in_seconds:
+        return []
+
+    keyframes = probe_keyframes(video_url, metadata['start_time'])
+    return split_at_keyframes(
+        keyframes,
+        metadata['duration'],
+        settings.conversion_segment_duration_in_seconds,
+    )
+
+
+@celery_app.task
+def probe_video_for_conversion(conversion_id: str):
+    """
+    Record the video metadata on the conversion and send it to a queue matching its cost.
+    It's cheap, since ffprobe reads only the container headers through a presigned URL.
+    """
+    log = logger.bind(conversion_id=conversion_id)
+
+    db = mongo_client.get_database(settings.mongodb.dbname)
+    collection = db.get_collection('conversions')
+
+    conversion = collection.find_one({'_id': bson.ObjectId(conversion_id)})
+    if not conversion:
+        log.error('Conversion was not found.')
+        return
+
+    metadata = probe_video(_generate_presigned_url(str(conversion['video_file_id'])))
+    if metadata:
+        collection.update_one({'_id': conversion['_id']}, {'$set': {'metadata': metadata}})
+    else:
+        log.warning('Could not probe the video.')
+
+    queue = _get_conversion_queue(metadata)
+    log.info('Scheduling the conversion.', queue=queue)
+    convert_video_to_gif.apply_async((conversion_id,), queue=queue)
+
+
+@celery_app.task
+def probe_videos_for_conversions(conversion_ids: list[str]):
+    """
+    Fan a batch of conversions out into a probe task each. The API sends a single message for
+    the whole batch, while the probes run in parallel and one failing doesn't hold up the rest.
+    """
+    group(probe_video_for_conversion.s(x) for x in conversion_ids).apply_async()
 
 
 @celery_app.task(bind=True, max_retries=3, default_retry_delay=30)
-def convert_video_to_gif(self, conversion_id: str):
+def convert_video_to_gif(self, conversion_id: str, escalated: bool = False):
     log = logger.bind(conversion_id=conversion_id)
     conversion_id = bson.ObjectId(conversion_id)
 
@@ -88,87 +582,227 @@ def convert_video_to_gif(self, conversion_id: str):
     _set_conversion_status(collection, conversion_id, owner_id, ConversionStatus.PROCESSING)
 
     video_file_id = conversion['video_file_id']
+    video_url = _generate_presigned_url(str(video_file_id))
 
-    try:
-        video_object = s3_client.get_object(Bucket=settings.s3.bucket, Key=str(video_file_id))
-    except ClientError:
-        log.error('Could not obtain a video file from the S3 bucket.', video_file_id=video_file_id)
-        _set_conversion_status(collection, conversion_id, owner_id, ConversionStatus.FAILED)
+    segments = _plan_segments(conversion, video_url)
+    if len(segments) > 1:
+        log.info('Converting the video in segments.', segments=len(segments))
+        _start_segmented_conversion(self, log, collection, conversion, video_url, segments)
         return
 
-    with tempfile.NamedTemporaryFile('wb') as file_input:
-        file_input.write(video_object['Body'].read())
-        file_input.flush()
+    gif_file_id = bson.ObjectId()
+    timeout = _get_conversion_timeout(conversion.get('metadata'), escalated=escalated)
+    with ExitStack() as stack:
+        video_key = str(video_file_id)
+        input_arg = None
+        input_chunks = None
+        if source_cache:
+            input_arg = stack.enter_context(source_cache.checkout(video_key))
 
-        # We have to specify the .gif suffix so ffmpeg understands the format of the output file.
-        with tempfile.NamedTemporaryFile('rb', suffix='.gif') as file_output:
-            # We use -y to automatically agree on file replacement.
-            popen = Popen(
-                ['ffmpeg', '-y', '-i', file_input.name, file_output.name],
+        if input_arg is None:
+            try:
+                video_object = s3_client.get_object(Bucket=settings.s3.bucket, Key=video_key)
+            except ClientError:
+                log.error(
+                    'Could not obtain a video file from the S3 bucket.',
+                    video_file_id=video_file_id,
+                )
+                _set_conversion_status(collection, conversion_id, owner_id, ConversionStatus.FAILED)
+                return
+            input_arg, input_chunks = stack.enter_context(
+                _open_video_input(video_key, video_object)
+            )
+
+        # We have to specify the output format since ffmpeg can't guess it from a pipe.
+        code = _encode_gif_to_s3(
+            log,
+            ['ffmpeg', '-i', input_arg, '-f', 'gif', 'pipe:1'],
+            str(gif_file_id),
+            timeout,
+            input_chunks=input_chunks,
+            metadata={'owner-id': str(owner_id)},
+            on_progress=_make_progress_callback(collection, conversion),
+        )
+
+    if code is None:
+        if not _can_escalate(timeout, escalated):
+            log.error('Conversion timed out with the biggest budget.')
+            _set_conversion_status(collection, conversion_id, owner_id, ConversionStatus.FAILED)
+            return
+
+        log.info('Retrying the conversion with a bigger budget.')
+        _retry_or_fail(
+            self,
+            log,
+            collection,
+            conversion_id,
+            owner_id,
+            'timeout',
+            kwargs={'escalated': True},
+            queue=ConversionQueue.LARGE,
+            countdown=0,
+        )
+        return
+
+    if code != 0:
+        log.error('ffmpeg failed', exit_code=code)
+        _retry_or_fail(self, log, collection, conversion_id, owner_id, 'ffmpeg failure')
+        return
+
+    _finish_conversion(log, db, conversion, gif_file_id)
+
+
+def _start_segmented_conversion(task, log, collection, conversion, video_url, segments):
+    """
+    Convert time ranges of the video on different workers and merge the results.
+    All the segments share one palette, so they look the same and are joined cheaply.
+    """
+    conversion_id = str(conversion['_id'])
+    owner_id = conversion['owner_id']
+
+    with tempfile.NamedTemporaryFile(suffix='.png') as palette:
+        # The palette is built from keyframes only. They are cheap to decode
+        # and represent the colors of the video well enough.
+        command = ['ffmpeg', '-y', '-skip_frame', 'nokey', '-i', video_url]
+        command += ['-vf', 'palettegen', '-frames:v', '1', '-update', '1', palette.name]
+        try:
+            code = subprocess.run(
+                command,
                 stdout=DEVNULL,
                 stderr=DEVNULL,
-            )
+                timeout=settings.conversion_process_timeout_in_seconds,
+            ).returncode
+        except subprocess.TimeoutExpired:
+            code = None
+
+        if code != 0:
+            log.error('Could not generate a palette.', exit_code=code)
+            _retry_or_fail(task, log, collection, conversion['_id'], owner_id, 'palette failure')
+            return
+
+        palette_key = _get_segment_key(conversion_id, 'palette.png')
+        s3_client.upload_file(palette.name, settings.s3.bucket, palette_key)
+
+    # Every segment goes to the queue matching its own cost, so they spread across more workers.
+    metadata = conversion['metadata']
+    header = [
+        convert_video_segment_to_gif.s(conversion_id, index, start, end).set(
+            queue=_get_conversion_queue(metadata, duration=end - start),
+        )
+        for index, (start, end) in enumerate(segments)
+    ]
+    callback = merge_gif_segments.s(conversion_id).on_error(
+        fail_segmented_conversion.s(conversion_id, len(segments)),
+    )
+    chord(header)(callback)
 
-            timeout = settings.conversion_process_timeout_in_seconds
-            try:
-                code = popen.wait(timeout=timeout)
-            except TimeoutExpired:
-                log.error('Conversion timed out.', timeout=timeout)
-                try:
-                    raise self.retry()
-                except MaxRetriesExceededError:
-                    log.error('Max retries exceeded after timeout.')
-                    _set_conversion_status(
-                        collection,
-                        conversion_id,
-                        owner_id,
-                        ConversionStatus.FAILED,
-                    )
-                    return
-
-            if code != 0:
-                log.error('ffmpeg failed', exit_code=code)
-                try:
-                    raise self.retry()
-                except MaxRetriesExceededError:
-                    log.error('Max retries exceeded after ffmpeg failure.')
-                    _set_conversion_status(
-                        collection,
-                        conversion_id,
-                        owner_id,
-                        ConversionStatus.FAILED,
-                    )
-                    return
-
-            gif_file_id = bson.ObjectId()
-            gif_s3_key = str(gif_file_id)
-            s3_client.put_object(
-                Bucket=settings.s3.bucket,
-                Key=gif_s3_key,
-                Body=file_output,
-                ContentType='image/gif',
-                Metadata={'owner-id': str(owner_id)},
-            )
-            gif_url = s3_client.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': settings.s3.bucket, 'Key': gif_s3_key},
-                ExpiresIn=settings.s3.presigned_url_expiry,
-            )
-            _set_conversion_status(
-                collection,
-                conversion_id,
-                owner_id,
-                ConversionStatus.DONE,
-                extra={'gif_file_id': gif_file_id, 'gif_url': gif_url},
-            )
 
-    webhook_url = conversion.get('webhook_url')
-    if webhook_url:
-        log.info(
-            'Scheduling a webhook request to notify about conversion completion.',
-            webhook_url=webhook_url,
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=30, ignore_result=False)
+def convert_video_segment_to_gif(
+    self,
+    conversion_id: str,
+    index: int,
+    start: float,
+    end: float,
+    escalated: bool = False,
+):
+    log = logger.bind(conversion_id=conversion_id, segment=index)
+
+    db = mongo_client.get_database(settings.mongodb.dbname)
+    collection = db.get_collection('conversions')
+
+    conversion = collection.find_one({'_id': bson.ObjectId(conversion_id)})
+    if not conversion:
+        log.error('Conversion was not found.')
+        return None
+
+    video_url = _generate_presigned_url(str(conversion['video_file_id']))
+    segment_key = _get_segment_key(conversion_id, f'{index}.gif')
+
+    with tempfile.NamedTemporaryFile(suffix='.png') as palette:
+        palette_key = _get_segment_key(conversion_id, 'palette.png')
+        s3_client.download_fileobj(settings.s3.bucket, palette_key, palette)
+        palette.flush()
+
+        # -ss before -i makes ffmpeg seek in the input instead of decoding everything before it.
+        command = ['ffmpeg', '-ss', str(start), '-i', video_url, '-i', palette.name]
+        command += ['-t', str(end - start), '-lavfi', '[0:v][1:v]paletteuse', '-f', 'gif', 'pipe:1']
+        timeout = _get_conversion_timeout(
+            conversion.get('metadata'),
+            duration=end - start,
+            escalated=escalated,
         )
-        send_webhook_conversion_done.delay(str(conversion_id))
+        code = _encode_gif_to_s3(log, command, segment_key, timeout)
+
+    if code == 0:
+        return segment_key
+
+    options = {}
+    if code is None:
+        if not _can_escalate(timeout, escalated):
+            log.error('Segment conversion timed out with the biggest budget.')
+            return None
+        options = {'kwargs': {'escalated': True}, 'queue': ConversionQueue.LARGE, 'countdown': 0}
+    else:
+        log.error('Could not convert a segment.', exit_code=code)
+
+    try:
+        raise self.retry(**options)
+    except MaxRetriesExceededError:
+        log.error('Max retries exceeded.')
+        return None
+
+
+@celery_app.task
+def merge_gif_segments(segment_keys: list[str | None], conversion_id: str):
+    log = logger.bind(conversion_id=conversion_id)
+
+    db = mongo_client.get_database(settings.mongodb.dbname)
+    collection = db.get_collection('conversions')
+
+    conversion = collection.find_one({'_id': bson.ObjectId(conversion_id)})
+    if not conversion:
+        log.error('Conversion was not found.')
+        _delete_segments(conversion_id, len(segment_keys))
+        return
+
+    owner_id = conversion['owner_id']
+    if not all(segment_keys):
+        log.error('Some segments were not converted.')
+        _delete_segments(conversion_id, len(segment_keys))
+        _set_conversion_status(collection, conversion['_id'], owner_id, ConversionStatus.FAILED)
+        return
+
+    gif_file_id = bson.ObjectId()
+    with MultipartUpload(
+        s3_client,
+        part_size=settings.s3.multipart_part_size,
+        concurrency=settings.s3.multipart_concurrency,
+        Bucket=settings.s3.bucket,
+        Key=str(gif_file_id),
+        ContentType='image/gif',
+        Metadata={'owner-id': str(owner_id)},
+    ) as upload:
+        concat_gifs(_iter_s3_files(segment_keys), upload.write)
+        upload.complete()
+
+    _delete_segments(conversion_id, len(segment_keys))
+    _finish_conversion(log, db, conversion, gif_file_id)
+
+
+@celery_app.task
+def fail_segmented_conversion(request, exc, traceback, conversion_id: str, segment_count: int):
+    logger.error('Segmented conversion failed.', conversion_id=conversion_id, error=str(exc))
+
+    db = mongo_client.get_database(settings.mongodb.dbname)
+    collection = db.get_collection('conversions')
+
+    conversion = collection.find_one({'_id': bson.ObjectId(conversion_id)})
+    if conversion:
+        owner_id = conversion['owner_id']
+        _set_conversion_status(collection, conversion['_id'], owner_id, ConversionStatus.FAILED)
+
+    _delete_segments(conversion_id, segment_count)
 
 
 @celery_app.task(
@@ -0,0 +1,102 @@
+import fcntl
+import os
+from contextlib import contextmanager
+
+from v2g.core.config import settings
+
+CGROUP_MEMORY_MAX_PATH = '/sys/fs/cgroup/memory.max'
+
+
+def get_cpu_count():
+    """Return the number of cores the worker may run on."""
+    return len(os.sched_getaffinity(0))
+
+
+def get_memory_limit():
+    """Return the memory available to the worker in bytes, respecting the container limit."""
+    memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    try:
+        with open(CGROUP_MEMORY_MAX_PATH) as file:
+            limit = file.read().strip()
+    except OSError:
+        return memory
+
+    if limit == 'max':
+        return memory
+    return min(memory, int(limit))
+
+
+def get_worker_concurrency():
+    """
+    Return the number of conversions a worker runs at once. Unless it's configured explicitly,
+    there is a slot per core as long as the memory allows.
+    """
+    if settings.celery_concurrency:
+        return settings.celery_concurrency
+
+    slots_by_memory = get_memory_limit() // settings.celery_memory_per_slot
+    return max(1, min(get_cpu_count(), slots_by_memory))
+
+
+def _try_lock(path):
+    """Return the file locked exclusively, or None if it's locked already."""
+    lock = open(path, 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+@contextmanager
+def acquire_cpu_budget():
+    """
+    Yield the cores a conversion may run on and the number of threads it may use.
+
+    Every running conversion holds a slot and its cores, so concurrent ffmpeg processes don't
+    thrash each other. The free cores are shared evenly by the slots not taken yet, so cores
+    left over by an uneven split aren't idle, but a conversion never gets fewer than its static
+    share (cores divided by slots). Slots and cores are locked with files, so it works for both
+    pools. The cores are None if fewer than the static share are free, e.g. if there are more
+    workers on the host than the slot count implies.
+    """
+    cores = sorted(os.sched_getaffinity(0))
+    concurrency = get_worker_concurrency()
+    min_group_size = max(1, len(cores) // concurrency)
+    lock_dir = settings.conversion_cpu_lock_dir
+    os.makedirs(lock_dir, exist_ok=True)
+
+    held = []
+    try:
+        # Conversions choose their cores one at a time, so they see each other's locks.
+        with open(os.path.join(lock_dir, 'budget.lock'), 'a') as budget_lock:
+            fcntl.flock(budget_lock, fcntl.LOCK_EX)
+
+            slot_locks = [
+                _try_lock(os.path.join(lock_dir, f'slot-{i}.lock')) for i in range(concurrency)
+            ]
+            free_slots = [x for x in slot_locks if x]
+            held.extend(free_slots[:1])
+            for lock in free_slots[1:]:
+                lock.close()
+
+            core_locks = {x: _try_lock(os.path.join(lock_dir, f'core-{x}.lock')) for x in cores}
+            free_cores = [x for x, lock in core_locks.items() if lock]
+            group_size = min_group_size
+            if free_slots:
+                group_size = max(group_size, len(free_cores) // len(free_slots))
+            group = free_cores[:group_size] if len(free_cores) >= min_group_size else []
+            for core in free_cores:
+                if core in group:
+                    held.append(core_locks[core])
+                else:
+                    core_locks[core].close()
+
+        if group:
+            yield group, len(group)
+        else:
+            yield None, min_group_size
+    finally:
+        for lock in held:
+            lock.close()
@@ -17,10 +17,45 @@ resource "aws_sqs_queue" "celery" {
   name = "celery"
 }
 
+resource "aws_sqs_queue" "small" {
+  name = "small"
+}
+
+resource "aws_sqs_queue" "large" {
+  name = "large"
+}
+
 resource "aws_s3_bucket" "files" {
   bucket = "v2g"
 }
 
+# Browsers upload videos to the bucket directly with presigned POST requests.
+resource "aws_s3_bucket_cors_configuration" "files" {
+  bucket = aws_s3_bucket.files.id
+
+  cors_rule {
+    allowed_methods = ["POST"]
+    allowed_origins = ["*"]
+    allowed_headers = ["*"]
+  }
+}
+
+# Resumable uploads that were never finalized.
+resource "aws_s3_bucket_lifecycle_configuration" "files" {
+  bucket = aws_s3_bucket.files.id
+
+  rule {
+    id     = "abort-incomplete-multipart-uploads"
+    status = "Enabled"
+
+    filter {}
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 2
+    }
+  }
+}
+
 output "celery_queue_url" {
   value = aws_sqs_queue.celery.url
 }
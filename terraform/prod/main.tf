@@ -130,6 +130,26 @@ resource "aws_sqs_queue" "celery" {
   }
 }
 
+resource "aws_sqs_queue" "small" {
+  name                       = "small"
+  visibility_timeout_seconds = 3600
+  message_retention_seconds  = 86400
+
+  tags = {
+    Name = "v2g-small"
+  }
+}
+
+resource "aws_sqs_queue" "large" {
+  name                       = "large"
+  visibility_timeout_seconds = 3600
+  message_retention_seconds  = 86400
+
+  tags = {
+    Name = "v2g-large"
+  }
+}
+
 resource "aws_iam_role_policy" "sqs_access" {
   name = "v2g-sqs-access"
   role = aws_iam_role.app.id
@@ -145,7 +165,11 @@ resource "aws_iam_role_policy" "sqs_access" {
         "sqs:GetQueueAttributes",
         "sqs:GetQueueUrl",
       ]
-      Resource = aws_sqs_queue.celery.arn
+      Resource = [
+        aws_sqs_queue.celery.arn,
+        aws_sqs_queue.small.arn,
+        aws_sqs_queue.large.arn,
+      ]
     }]
   })
 }
@@ -158,6 +182,33 @@ resource "aws_s3_bucket" "files" {
   }
 }
 
+# Browsers upload videos to the bucket directly with presigned POST requests.
+resource "aws_s3_bucket_cors_configuration" "files" {
+  bucket = aws_s3_bucket.files.id
+
+  cors_rule {
+    allowed_methods = ["POST"]
+    allowed_origins = ["*"]
+    allowed_headers = ["*"]
+  }
+}
+
+# Resumable uploads that were never finalized.
+resource "aws_s3_bucket_lifecycle_configuration" "files" {
+  bucket = aws_s3_bucket.files.id
+
+  rule {
+    id     = "abort-incomplete-multipart-uploads"
+    status = "Enabled"
+
+    filter {}
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 2
+    }
+  }
+}
+
 resource "aws_iam_role_policy" "s3_access" {
   name = "v2g-s3-access"
   role = aws_iam_role.app.id
@@ -170,6 +221,7 @@ resource "aws_iam_role_policy" "s3_access" {
         "s3:PutObject",
         "s3:GetObject",
         "s3:DeleteObject",
+        "s3:AbortMultipartUpload",
       ]
       Resource = "${aws_s3_bucket.files.arn}/*"
     }]
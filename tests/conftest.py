@@ -4,10 +4,60 @@ import aioboto3
 import pytest
 import pytest_asyncio
 import redis
-from pymongo import AsyncMongoClient
+from pymongo import AsyncMongoClient, MongoClient, monitoring
 
 from v2g.core.config import settings
 
+EXPLAINABLE_COMMANDS = {
+    'find',
+    'aggregate',
+    'count',
+    'distinct',
+    'findAndModify',
+    'update',
+    'delete',
+}
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Record queries of all Mongo clients while `commands` is a list."""
+
+    commands = None
+
+    def started(self, event):
+        if self.commands is not None and event.command_name in EXPLAINABLE_COMMANDS:
+            command = {
+                k: v
+                for k, v in event.command.items()
+                if not k.startswith('$') and k not in ('lsid', 'txnNumber')
+            }
+            self.commands.append((event.database_name, command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Listeners have to be registered before clients are created.
+command_recorder = CommandRecorder()
+monitoring.register(command_recorder)
+
+
+@pytest.fixture
+def no_collscan():
+    """Fail if any query made during the test scans a whole collection."""
+    command_recorder.commands = []
+    yield
+    commands, command_recorder.commands = command_recorder.commands, None
+
+    with MongoClient(host=settings.mongodb.host, port=settings.mongodb.port) as client:
+        for database_name, command in commands:
+            plan = client[database_name].command('explain', command, verbosity='queryPlanner')
+            # Aggregations keep plans of their stages apart, so the whole output is searched.
+            assert 'COLLSCAN' not in str(plan), command
+
 
 @pytest_asyncio.fixture
 async def s3_client():
@@ -0,0 +1,42 @@
+from fastapi import FastAPI, Request, UploadFile
+from fastapi.testclient import TestClient
+
+from v2g.middlewares.body_size import BodySizeLimitMiddleware
+
+app = FastAPI()
+app.add_middleware(BodySizeLimitMiddleware, max_size=10)
+
+
+@app.post('/upload/')
+async def upload(file: UploadFile):
+    return {'size': len(await file.read())}
+
+
+@app.post('/stream/')
+async def stream(request: Request):
+    return {'size': sum([len(x) async for x in request.stream()])}
+
+
+def test_should_accept_small_body():
+    with TestClient(app) as client:
+        response = client.post('/stream/', content=b'1234567890')
+        assert response.status_code == 200
+        assert response.json() == {'size': 10}
+
+
+def test_should_reject_body_by_content_length():
+    with TestClient(app) as client:
+        response = client.post('/upload/', files={'file': b'12345678901'})
+        assert response.status_code == 413
+        assert response.json() == {'detail': 'The request body is too large.'}
+
+
+def test_should_reject_body_while_streaming():
+    def chunks():
+        yield b'123456'
+        yield b'789012'
+
+    with TestClient(app) as client:
+        response = client.post('/stream/', content=chunks())
+        assert response.status_code == 413
+        assert response.json() == {'detail': 'The request body is too large.'}
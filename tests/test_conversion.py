@@ -1,14 +1,20 @@
+import hashlib
 import io
+import os
+import threading
+import time
 from unittest.mock import patch
 
 import bson
 import httpx
 import pytest
 from fastapi.testclient import TestClient
+from limits import parse_many
 
 import v2g.tasks as tasks
 from v2g.app import app
 from v2g.core.config import settings
+from v2g.modules.conversions.models import CONVERSION_PARAMS
 from v2g.modules.conversions.repositories import ConversionRepository
 
 from .utils import create_user_and_token
@@ -25,11 +31,14 @@ async def test_conversion(mongo_client, video_file):
     webhook_url = 'http://localhost:8000/'
     _, token = await create_user_and_token(mongo_client)
 
+    # Otherwise the GIF could be taken from a previous run.
+    await mongo_client[settings.mongodb.dbname]['conversion_cache'].delete_many({})
+
     with TestClient(app) as client:
         # Should run conversion.
 
-        convert_video_to_gif_ = 'v2g.modules.conversions.routes.convert_video_to_gif'
-        with patch(convert_video_to_gif_) as mock_convert_video_to_gif:
+        probe_video_ = 'v2g.modules.conversions.routes.probe_video_for_conversion'
+        with patch(probe_video_) as mock_probe_video:
             response = client.post(
                 URL_CONVERSIONS,
                 data={'webhook_url': webhook_url},
@@ -45,19 +54,36 @@ async def test_conversion(mongo_client, video_file):
             assert result['gif_url'] is None
             assert result['status'] == 'pending'
 
-        mock_convert_video_to_gif.delay.assert_called_once_with(conversion_id)
+        mock_probe_video.delay.assert_called_once_with(conversion_id)
+
+        # Should record the video metadata and route the conversion by its cost.
+
+        with patch('v2g.tasks.convert_video_to_gif') as mock_convert_video_to_gif:
+            tasks.probe_video_for_conversion(conversion_id)
+
+        mock_convert_video_to_gif.apply_async.assert_called_once_with(
+            (conversion_id,),
+            queue='small',
+        )
+
+        collection = mongo_client[settings.mongodb.dbname]['conversions']
+        conversion = await collection.find_one({'_id': bson.ObjectId(conversion_id)})
+        metadata = conversion['metadata']
+        assert metadata['duration'] > 0
+        assert metadata['width'] and metadata['height']
+        assert metadata['codec']
 
         with patch('v2g.tasks.send_webhook_conversion_done') as mock_send_webhook_conversion_done:
             tasks.convert_video_to_gif(conversion_id)
 
         mock_send_webhook_conversion_done.delay.assert_called_once_with(conversion_id)
 
-        collection = mongo_client[settings.mongodb.dbname]['conversions']
         conversion = await collection.find_one({'_id': bson.ObjectId(conversion_id)})
 
         video_file_id = str(conversion['video_file_id'])
         gif_file_id = str(conversion['gif_file_id'])
         assert gif_file_id
+        assert 0 <= conversion['progress']['percent'] <= 100
 
         with patch('httpx.Client.post') as mock_post:
             mock_post.return_value = httpx.Response(200)
@@ -126,12 +152,12 @@ async def test_should_get_404_if_not_own_conversion(mongo_client, s3_client):
         mongo_client=mongo_client,
         s3_client=s3_client,
     )
-    conversion_id = await conversion_repo.create(
+    conversion = await conversion_repo.create(
         io.BytesIO(b'123'),
-        '',
         'example/example',
         another_user_id,
     )
+    conversion_id = conversion['_id']
 
     with TestClient(app) as client:
         response = client.get(
@@ -140,3 +166,302 @@ async def test_should_get_404_if_not_own_conversion(mongo_client, s3_client):
         )
         assert response.status_code == 404
         assert response.json() == {'detail': 'Not Found'}
+
+
+@pytest.mark.asyncio
+async def test_should_take_gif_from_cache(mongo_client):
+    _, token = await create_user_and_token(mongo_client)
+    headers = {'Authorization': 'Bearer ' + token.access_token}
+
+    content = bson.ObjectId().binary
+    cache_coll = mongo_client[settings.mongodb.dbname]['conversion_cache']
+    gif_file_id = bson.ObjectId()
+    await cache_coll.insert_one(
+        {
+            'content_hash': hashlib.sha256(content).hexdigest(),
+            'params': CONVERSION_PARAMS,
+            'video_file_id': bson.ObjectId(),
+            'gif_file_id': gif_file_id,
+            'refcount': 1,
+        }
+    )
+
+    with TestClient(app) as client:
+        probe_video_ = 'v2g.modules.conversions.routes.probe_video_for_conversion'
+        with patch(probe_video_) as mock_probe_video:
+            response = client.post(
+                URL_CONVERSIONS,
+                files={'file': ('cat.mp4', io.BytesIO(content))},
+                headers=headers,
+            )
+            assert response.status_code == 200
+            result = response.json()
+
+            assert result['status'] == 'done'
+            assert result['gif_url'] and str(gif_file_id) in result['gif_url']
+
+        mock_probe_video.delay.assert_not_called()
+
+        entry = await cache_coll.find_one({'gif_file_id': gif_file_id})
+        assert entry['refcount'] == 2
+
+        # The GIF is still used by someone else, so only the reference is released.
+
+        response = client.delete(get_conversion_url(result['id']), headers=headers)
+        assert response.status_code == 204
+
+        entry = await cache_coll.find_one({'gif_file_id': gif_file_id})
+        assert entry['refcount'] == 1
+
+        response = client.get(get_conversion_url(result['id']), headers=headers)
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_should_share_gif_once_per_conversion(mongo_client):
+    db = tasks.mongo_client[settings.mongodb.dbname]
+    video_file_id = bson.ObjectId()
+    conversion = {
+        '_id': bson.ObjectId(),
+        'video_file_id': video_file_id,
+        'content_hash': hashlib.sha256(bson.ObjectId().binary).hexdigest(),
+    }
+    gif_file_id = bson.ObjectId()
+    retry_gif_file_id = bson.ObjectId()
+
+    with patch('v2g.tasks.s3_client') as mock_s3_client:
+        assert tasks._share_gif(db, conversion, gif_file_id) == gif_file_id
+        # A retry of the conversion encodes the GIF again.
+        assert tasks._share_gif(db, conversion, retry_gif_file_id) == gif_file_id
+
+    cache_coll = mongo_client[settings.mongodb.dbname]['conversion_cache']
+    entry = await cache_coll.find_one({'content_hash': conversion['content_hash']})
+    assert entry['refcount'] == 1
+    assert entry['video_file_id'] == video_file_id
+
+    # Only the new GIF is deleted, the video is the cached one.
+    mock_s3_client.delete_objects.assert_called_once()
+    objects = mock_s3_client.delete_objects.call_args.kwargs['Delete']['Objects']
+    assert objects == [{'Key': str(retry_gif_file_id)}]
+
+
+@pytest.mark.asyncio
+async def test_should_discard_uploaded_parts_if_gif_is_cached(mongo_client, s3_client, monkeypatch):
+    # S3 doesn't accept smaller parts (except the last one).
+    part_size = 5 * 1024 * 1024
+    monkeypatch.setattr(settings.s3, 'multipart_part_size', part_size)
+    content = os.urandom(part_size + 1024)
+
+    cache_coll = mongo_client[settings.mongodb.dbname]['conversion_cache']
+    gif_file_id = bson.ObjectId()
+    await cache_coll.insert_one(
+        {
+            'content_hash': hashlib.sha256(content).hexdigest(),
+            'params': CONVERSION_PARAMS,
+            'video_file_id': bson.ObjectId(),
+            'gif_file_id': gif_file_id,
+            'refcount': 1,
+        }
+    )
+
+    conversion_repo = ConversionRepository(
+        request=None,
+        mongo_client=mongo_client,
+        s3_client=s3_client,
+    )
+    video_file_id = bson.ObjectId()
+    content_hash, cached = await conversion_repo._upload_video(
+        io.BytesIO(content),
+        video_file_id,
+        'video/mp4',
+        bson.ObjectId(),
+    )
+
+    assert content_hash == hashlib.sha256(content).hexdigest()
+    assert cached['gif_file_id'] == gif_file_id
+    assert cached['refcount'] == 2
+
+    response = await s3_client.list_objects_v2(Bucket=settings.s3.bucket, Prefix=str(video_file_id))
+    assert response['KeyCount'] == 0
+
+
+@pytest.mark.asyncio
+async def test_should_run_conversions_in_batch(mongo_client, video_file):
+    _, token = await create_user_and_token(mongo_client)
+    content = video_file.read()
+
+    with TestClient(app) as client:
+        probe_videos_ = 'v2g.modules.conversions.routes.probe_videos_for_conversions'
+        with patch(probe_videos_) as mock_probe_videos:
+            response = client.post(
+                URL_CONVERSIONS + 'batch/',
+                files=[
+                    ('files', ('first.mp4', io.BytesIO(bson.ObjectId().binary + content))),
+                    ('files', ('second.mp4', io.BytesIO(bson.ObjectId().binary + content))),
+                ],
+                headers={'Authorization': 'Bearer ' + token.access_token},
+            )
+            assert response.status_code == 200
+            result = response.json()
+
+        assert len(result) == 2
+        assert all(x['status'] == 'pending' for x in result)
+
+        conversion_ids = [x['id'] for x in result]
+        mock_probe_videos.delay.assert_called_once_with(conversion_ids)
+
+        collection = mongo_client[settings.mongodb.dbname]['conversions']
+        count = await collection.count_documents(
+            {'_id': {'$in': [bson.ObjectId(x) for x in conversion_ids]}}
+        )
+        assert count == 2
+
+
+@pytest.mark.asyncio
+async def test_should_count_batch_videos_against_conversion_limit(mongo_client):
+    _, token = await create_user_and_token(mongo_client)
+    count = min(x.amount for x in parse_many(settings.rate_limit_create_conversions)) + 1
+
+    with TestClient(app) as client:
+        response = client.post(
+            URL_CONVERSIONS + 'batch/',
+            files=[('files', (f'{i}.mp4', io.BytesIO(b'video'))) for i in range(count)],
+            headers={'Authorization': 'Bearer ' + token.access_token},
+        )
+        assert response.status_code == 429
+
+
+class BrokenFile:
+    def read(self, size=-1):
+        raise OSError('The connection was reset.')
+
+
+@pytest.mark.asyncio
+async def test_should_clean_up_if_batch_fails(mongo_client, s3_client, video_file):
+    user_id, _ = await create_user_and_token(mongo_client)
+    conversion_repo = ConversionRepository(
+        request=None,
+        mongo_client=mongo_client,
+        s3_client=s3_client,
+    )
+
+    uploaded = []
+    upload_video = ConversionRepository._upload_video
+
+    async def record_upload(self, file, video_file_id, *args):
+        uploaded.append(video_file_id)
+        return await upload_video(self, file, video_file_id, *args)
+
+    files = [
+        (io.BytesIO(bson.ObjectId().binary + video_file.read()), 'video/mp4'),
+        (BrokenFile(), 'video/mp4'),
+    ]
+    with patch.object(ConversionRepository, '_upload_video', record_upload):
+        with pytest.raises(OSError):
+            await conversion_repo.create_many(files, user_id)
+
+    assert len(uploaded) == 2
+    for video_file_id in uploaded:
+        response = await s3_client.list_objects_v2(
+            Bucket=settings.s3.bucket,
+            Prefix=str(video_file_id),
+        )
+        assert response['KeyCount'] == 0
+
+    collection = mongo_client[settings.mongodb.dbname]['conversions']
+    assert await collection.count_documents({'owner_id': user_id}) == 0
+
+
+@pytest.mark.asyncio
+async def test_should_get_conversions_in_batch(mongo_client, s3_client):
+    user_id, token = await create_user_and_token(mongo_client)
+
+    conversion_repo = ConversionRepository(
+        request=None,
+        mongo_client=mongo_client,
+        s3_client=s3_client,
+    )
+    own_ids = [bson.ObjectId(), bson.ObjectId()]
+    another_id = bson.ObjectId()
+    for conversion_id in own_ids:
+        await conversion_repo.create_for_uploaded_video(conversion_id, bson.ObjectId(), user_id)
+    await conversion_repo.create_for_uploaded_video(another_id, bson.ObjectId(), bson.ObjectId())
+
+    with TestClient(app) as client:
+        response = client.get(
+            URL_CONVERSIONS + 'batch/',
+            params={'ids': [str(x) for x in [own_ids[1], another_id, own_ids[0]]]},
+            headers={'Authorization': 'Bearer ' + token.access_token},
+        )
+        assert response.status_code == 200
+
+        result = response.json()
+        assert [x['id'] for x in result] == [str(own_ids[1]), str(own_ids[0])]
+        assert all(x['status'] == 'pending' for x in result)
+
+
+@pytest.mark.asyncio
+async def test_should_list_conversions_by_pages(mongo_client, s3_client):
+    user_id, token = await create_user_and_token(mongo_client)
+    headers = {'Authorization': 'Bearer ' + token.access_token}
+
+    conversion_repo = ConversionRepository(
+        request=None,
+        mongo_client=mongo_client,
+        s3_client=s3_client,
+    )
+    conversion_ids = [bson.ObjectId() for _ in range(3)]
+    for conversion_id in conversion_ids:
+        await conversion_repo.create_for_uploaded_video(conversion_id, bson.ObjectId(), user_id)
+
+    with TestClient(app) as client:
+        response = client.get(URL_CONVERSIONS, params={'limit': 2}, headers=headers)
+        assert response.status_code == 200
+        page = response.json()
+        assert [x['id'] for x in page['items']] == [str(x) for x in conversion_ids[:0:-1]]
+
+        response = client.get(
+            URL_CONVERSIONS,
+            params={'limit': 2, 'after': page['next_after']},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        page = response.json()
+        assert [x['id'] for x in page['items']] == [str(conversion_ids[0])]
+        assert page['next_after'] is None
+
+        response = client.get(URL_CONVERSIONS, params={'status': 'done'}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()['items'] == []
+
+
+@pytest.mark.asyncio
+async def test_should_wait_for_status_change(mongo_client, s3_client):
+    user_id, token = await create_user_and_token(mongo_client)
+
+    conversion_repo = ConversionRepository(
+        request=None,
+        mongo_client=mongo_client,
+        s3_client=s3_client,
+    )
+    conversion_id = bson.ObjectId()
+    await conversion_repo.create_for_uploaded_video(conversion_id, bson.ObjectId(), user_id)
+
+    def finish_conversion():
+        collection = tasks.mongo_client[settings.mongodb.dbname]['conversions']
+        tasks._set_conversion_status(collection, conversion_id, user_id, 'done')
+
+    with TestClient(app) as client:
+        timer = threading.Timer(0.5, finish_conversion)
+        timer.start()
+
+        started_at = time.monotonic()
+        response = client.get(
+            get_conversion_url(conversion_id),
+            params={'wait': 10},
+            headers={'Authorization': 'Bearer ' + token.access_token},
+        )
+        assert response.status_code == 200
+        assert response.json()['status'] == 'done'
+        assert time.monotonic() - started_at < 10
+        timer.join()
@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+import bson
+import pytest
+import redis.asyncio as aioredis
+
+import v2g.tasks as tasks
+from v2g.core.config import settings
+from v2g.core.event_hub import EventHub
+from v2g.modules.events.routes import _stream_events
+
+
+@pytest.mark.asyncio
+async def test_should_replay_missed_events():
+    user_id = bson.ObjectId()
+    tasks._publish_event(user_id, {'conversion_id': '1', 'status': 'processing'})
+    tasks._publish_event(user_id, {'conversion_id': '1', 'status': 'done'})
+
+    log_key = f'user:{user_id}:log'
+    (first_id, _), (second_id, _) = tasks.redis_client.xrange(log_key)
+
+    async with (
+        aioredis.Redis(host=settings.redis.host, port=settings.redis.port) as redis_client,
+        EventHub(redis_client) as event_hub,
+    ):
+        events = _stream_events(event_hub, user_id, first_id.decode())
+        event = await anext(events)
+        data = '{"conversion_id": "1", "status": "done"}'
+        assert event == f'id: {second_id.decode()}\ndata: {data}\n\n'
+
+        # Should go on with live events.
+        tasks._publish_event(user_id, {'conversion_id': '2', 'status': 'processing'})
+        event = await anext(events)
+        assert '"conversion_id": "2"' in event
+
+        await events.aclose()
+
+
+@pytest.mark.asyncio
+async def test_should_ask_to_resync_when_missed_events_are_trimmed():
+    user_id = bson.ObjectId()
+    for status in ('processing', 'done'):
+        tasks._publish_event(user_id, {'conversion_id': '1', 'status': status})
+
+    log_key = f'user:{user_id}:log'
+    (first_id, _), _ = tasks.redis_client.xrange(log_key)
+    tasks.redis_client.xtrim(log_key, maxlen=1, approximate=False)
+
+    async with (
+        aioredis.Redis(host=settings.redis.host, port=settings.redis.port) as redis_client,
+        EventHub(redis_client) as event_hub,
+    ):
+        events = _stream_events(event_hub, user_id, first_id.decode())
+        assert await anext(events) == 'data: {"type": "resync"}\n\n'
+        # What is still in the log is sent anyway.
+        assert '"status": "done"' in await anext(events)
+        await events.aclose()
+
+
+def test_should_not_log_progress_events():
+    user_id = bson.ObjectId()
+    tasks._publish_event(user_id, {'conversion_id': '1', 'status': 'processing'}, logged=False)
+
+    assert tasks.redis_client.xrange(f'user:{user_id}:log') == []
+
+
+@pytest.mark.asyncio
+async def test_should_deliver_sharded_events(monkeypatch):
+    monkeypatch.setattr(settings.redis, 'sharded_pubsub', True)
+    user_id = bson.ObjectId()
+
+    async with (
+        asyncio.timeout(5),
+        aioredis.Redis(host=settings.redis.host, port=settings.redis.port) as redis_client,
+        EventHub(redis_client) as event_hub,
+        event_hub.subscribe(f'user:{user_id}:events') as queue,
+    ):
+        tasks._publish_event(user_id, {'conversion_id': '1', 'status': 'done'})
+        message = json.loads(await queue.get())
+
+    assert message['conversion_id'] == '1'
+    assert message['status'] == 'done'
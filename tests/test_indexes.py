@@ -0,0 +1,45 @@
+import datetime
+
+import bson
+import pytest
+
+from v2g.core.config import settings
+from v2g.core.database import ensure_indexes
+from v2g.modules.conversions.models import ConversionStatus
+from v2g.modules.conversions.repositories import ConversionRepository
+from v2g.modules.uploads.repositories import UploadRepository
+from v2g.modules.users.repositories import UserRepository
+
+
+@pytest.mark.asyncio
+async def test_repository_queries_should_use_indexes(mongo_client, s3_client, no_collscan):
+    await ensure_indexes(mongo_client.get_database(settings.mongodb.dbname))
+
+    user_repo = UserRepository(request=None, mongo_client=mongo_client)
+    conversion_repo = ConversionRepository(
+        request=None,
+        mongo_client=mongo_client,
+        s3_client=s3_client,
+    )
+    upload_repo = UploadRepository(request=None, mongo_client=mongo_client, s3_client=s3_client)
+
+    owner_id = bson.ObjectId()
+    conversion_id = bson.ObjectId()
+    await conversion_repo.create_for_uploaded_video(conversion_id, bson.ObjectId(), owner_id)
+
+    await user_repo.get_by_id(owner_id)
+    await user_repo.get_by_username('test')
+    await user_repo.get_profile(owner_id, 10)
+    await conversion_repo.get(id_=conversion_id, owner_id=owner_id)
+    await conversion_repo.get_many([conversion_id], owner_id)
+    await conversion_repo.get_page(owner_id, limit=10)
+    await conversion_repo.get_page(
+        owner_id,
+        limit=10,
+        after=conversion_id,
+        status=ConversionStatus.PENDING,
+        created_after=datetime.datetime(2020, 1, 1),
+    )
+    await conversion_repo._acquire_cached_gif('0' * 64)
+    await conversion_repo.delete(conversion_id, owner_id)
+    await upload_repo.get(bson.ObjectId(), owner_id)
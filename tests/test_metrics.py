@@ -0,0 +1,21 @@
+import os
+import subprocess
+
+from v2g.middlewares.metrics import mark_crashed_workers_dead
+
+
+def test_should_drop_live_gauges_of_crashed_workers(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+    process = subprocess.Popen(['true'])
+    process.wait()
+
+    for pid in (process.pid, os.getpid()):
+        (tmp_path / f'gauge_livesum_{pid}.db').touch()
+    (tmp_path / f'counter_{process.pid}.db').touch()
+
+    mark_crashed_workers_dead()
+
+    assert sorted(x.name for x in tmp_path.iterdir()) == [
+        f'counter_{process.pid}.db',
+        f'gauge_livesum_{os.getpid()}.db',
+    ]
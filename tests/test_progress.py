@@ -0,0 +1,30 @@
+from unittest.mock import Mock, patch
+
+import bson
+
+from v2g.tasks import _ProgressReporter
+
+
+def test_should_send_held_back_progress_on_flush():
+    collection = Mock()
+    conversion = {'_id': bson.ObjectId(), 'owner_id': bson.ObjectId()}
+    reporter = _ProgressReporter(collection, conversion, duration=10)
+
+    with patch('v2g.tasks._publish_event') as mock_publish_event:
+        reporter(1, 1.0)
+        reporter(5, 1.0)
+        reporter(10, 1.0)
+        # Too soon after the first one.
+        assert mock_publish_event.call_count == 1
+        assert mock_publish_event.call_args.kwargs['logged'] is False
+
+        reporter.flush()
+        assert mock_publish_event.call_count == 2
+        assert mock_publish_event.call_args.args[1]['progress']['percent'] == 100
+
+        # Nothing is held back anymore.
+        reporter.flush()
+        assert mock_publish_event.call_count == 2
+
+    progress = collection.update_one.call_args.args[1]['$set']['progress']
+    assert progress == {'percent': 100, 'eta_in_seconds': 0}
@@ -0,0 +1,22 @@
+from unittest.mock import patch
+
+from v2g.core.config import settings
+from v2g.core.redis import create_async_redis_client, create_redis_client
+
+
+def test_should_connect_to_cluster_for_sharded_pubsub(monkeypatch):
+    monkeypatch.setattr(settings.redis, 'sharded_pubsub', True)
+
+    with patch('v2g.core.redis.RedisCluster') as mock_cluster:
+        assert create_redis_client() is mock_cluster.return_value
+    mock_cluster.assert_called_once_with(host=settings.redis.host, port=settings.redis.port)
+
+    with patch('v2g.core.redis.AsyncRedisCluster') as mock_cluster:
+        assert create_async_redis_client() is mock_cluster.return_value
+    mock_cluster.assert_called_once_with(host=settings.redis.host, port=settings.redis.port)
+
+
+def test_should_connect_to_single_node_by_default():
+    with patch('v2g.core.redis.RedisCluster') as mock_cluster:
+        create_redis_client()
+    mock_cluster.assert_not_called()
@@ -0,0 +1,24 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from v2g.core.config import settings
+from v2g.core.security import get_password_hash, verify_password
+
+
+@pytest.mark.asyncio
+async def test_should_hash_with_configured_rounds():
+    password_hash = await get_password_hash('password')
+
+    assert password_hash.startswith(f'$2b${settings.password_hash_rounds:02d}$')
+    assert await verify_password('password', password_hash)
+    assert not await verify_password('wrong password', password_hash)
+
+
+@pytest.mark.asyncio
+async def test_should_empty_queue_after_concurrent_calls():
+    count = settings.password_hash_concurrency * 2
+    await asyncio.gather(*(get_password_hash('password') for _ in range(count)))
+
+    assert REGISTRY.get_sample_value('password_hash_queue_size') == 0
@@ -0,0 +1,50 @@
+import io
+
+from v2g.ffmpeg import split_at_keyframes
+from v2g.gif import concat_gifs
+
+IMAGE_DATA = bytes([0x02, 0x02, 0x44, 0x01, 0x00])
+LOOP_EXTENSION = b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00'
+
+
+def make_gif(color_table):
+    """A single-frame 1x1 GIF with a global color table of two colors."""
+    screen = b'GIF89a' + bytes([1, 0, 1, 0, 0x80, 0, 0]) + color_table
+    image = b'\x2c' + bytes([0, 0, 0, 0, 1, 0, 1, 0, 0]) + IMAGE_DATA
+    return screen + LOOP_EXTENSION + image + b'\x3b'
+
+
+def concat(gifs):
+    chunks = []
+    concat_gifs([io.BytesIO(x) for x in gifs], chunks.append)
+    return b''.join(chunks)
+
+
+def test_should_split_at_keyframes():
+    keyframes = [0.0, 10.0, 20.0, 30.0, 40.0, 50.0]
+    segments = split_at_keyframes(keyframes, 55.0, 15)
+    assert segments == [(0.0, 20.0), (20.0, 40.0), (40.0, 55.0)]
+
+
+def test_should_not_split_short_video():
+    assert split_at_keyframes([0.0, 2.0, 4.0], 5.0, 30) == [(0.0, 5.0)]
+
+
+def test_should_concat_gifs_with_same_palette():
+    color_table = b'\x00\x00\x00\xff\xff\xff'
+    gif = make_gif(color_table)
+    result = concat([gif, gif])
+
+    frame = b'\x2c' + bytes([0, 0, 0, 0, 1, 0, 1, 0, 0]) + IMAGE_DATA
+    assert result == gif[:-1] + frame + b'\x3b'
+
+
+def test_should_concat_gifs_with_different_palettes():
+    first_color_table = b'\x00\x00\x00\xff\xff\xff'
+    second_color_table = b'\xff\x00\x00\x00\xff\x00'
+    first_gif = make_gif(first_color_table)
+    result = concat([first_gif, make_gif(second_color_table)])
+
+    # The second frame gets its palette as a local color table.
+    frame = b'\x2c' + bytes([0, 0, 0, 0, 1, 0, 1, 0, 0x80]) + second_color_table + IMAGE_DATA
+    assert result == first_gif[:-1] + frame + b'\x3b'
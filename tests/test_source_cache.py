@@ -0,0 +1,52 @@
+import os
+
+from v2g.source_cache import SourceCache
+
+
+def put(cache, key, data):
+    with cache.create(key) as file:
+        file.write(data)
+        cache.commit(key, file)
+
+
+def test_should_return_cached_video(tmp_path):
+    cache = SourceCache(str(tmp_path), max_size=1024)
+
+    with cache.checkout('video') as path:
+        assert path is None
+
+    put(cache, 'video', b'content')
+    with cache.checkout('video') as path:
+        with open(path, 'rb') as file:
+            assert file.read() == b'content'
+    assert not os.path.exists(path)
+
+
+def test_should_not_cache_uncommitted_video(tmp_path):
+    cache = SourceCache(str(tmp_path), max_size=1024)
+
+    with cache.create('video') as file:
+        file.write(b'partial')
+
+    with cache.checkout('video') as path:
+        assert path is None
+
+
+def test_should_evict_least_recently_used_videos(tmp_path):
+    cache = SourceCache(str(tmp_path), max_size=10)
+
+    put(cache, 'first', b'12345')
+    put(cache, 'second', b'12345')
+    os.utime(tmp_path / 'objects' / 'first', (0, 0))
+    os.utime(tmp_path / 'objects' / 'second', (1, 1))
+    # The first one was used most recently, so the second one goes.
+    with cache.checkout('first'):
+        pass
+    put(cache, 'third', b'12345')
+
+    with cache.checkout('first') as path:
+        assert path is not None
+    with cache.checkout('second') as path:
+        assert path is None
+    with cache.checkout('third') as path:
+        assert path is not None
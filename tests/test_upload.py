@@ -0,0 +1,193 @@
+import io
+import os
+from unittest.mock import patch
+
+import bson
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from limits import parse_many
+
+from v2g.app import app
+from v2g.core.config import settings
+from v2g.rate_limiter import CREATE_CONVERSIONS_SCOPE, limiter
+
+from .utils import create_user_and_token
+
+URL_UPLOADS = f'{settings.api_v1_str}/uploads/'
+URL_CONVERSIONS = f'{settings.api_v1_str}/conversions/'
+
+
+def get_finalize_url(upload_id):
+    return f'{URL_UPLOADS}{upload_id}/finalize/'
+
+
+@pytest.mark.asyncio
+async def test_upload(mongo_client, video_file):
+    _, token = await create_user_and_token(mongo_client)
+    headers = {'Authorization': 'Bearer ' + token.access_token}
+    size = os.fstat(video_file.fileno()).st_size
+
+    with TestClient(app) as client:
+        response = client.post(
+            URL_UPLOADS,
+            json={'content_type': 'video/mp4', 'size': size},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        upload = response.json()
+
+        # Should not run the conversion before the video is uploaded.
+
+        response = client.post(get_finalize_url(upload['id']), headers=headers)
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'The video has not been uploaded yet.'}
+
+        response = httpx.post(
+            upload['url'],
+            data=upload['fields'],
+            files={'file': video_file},
+        )
+        assert response.is_success
+
+        probe_video_ = 'v2g.modules.uploads.routes.probe_video_for_conversion'
+        with patch(probe_video_) as mock_probe_video:
+            response = client.post(get_finalize_url(upload['id']), headers=headers)
+            assert response.status_code == 200
+            result = response.json()
+
+            conversion_id = result['id']
+            assert conversion_id and bson.ObjectId(conversion_id)
+            assert result['status'] == 'pending'
+
+            # Should not run the conversion twice.
+
+            response = client.post(get_finalize_url(upload['id']), headers=headers)
+            assert response.status_code == 400
+            assert response.json() == {'detail': 'The upload is finalized already.'}
+
+        mock_probe_video.delay.assert_called_once_with(conversion_id)
+
+        collection = mongo_client[settings.mongodb.dbname]['conversions']
+        conversion = await collection.find_one({'_id': bson.ObjectId(conversion_id)})
+        assert conversion['status'] == 'pending'
+        assert conversion['video_file_id']
+
+
+@pytest.mark.asyncio
+async def test_should_discard_upload_if_too_large(mongo_client):
+    _, token = await create_user_and_token(mongo_client)
+
+    with TestClient(app) as client:
+        response = client.post(
+            URL_UPLOADS,
+            json={'content_type': 'video/mp4', 'size': settings.upload_max_size + 1},
+            headers={'Authorization': 'Bearer ' + token.access_token},
+        )
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'The video is too large.'}
+
+
+@pytest.mark.asyncio
+async def test_resumable_upload(mongo_client, video_file):
+    _, token = await create_user_and_token(mongo_client)
+    headers = {'Authorization': 'Bearer ' + token.access_token}
+    content = video_file.read()
+
+    with TestClient(app) as client:
+        response = client.post(
+            URL_UPLOADS + 'resumable/',
+            json={'content_type': 'video/mp4', 'size': len(content)},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        upload = response.json()
+        assert upload['offset'] == 0
+
+        url = f'{URL_UPLOADS}resumable/{upload["id"]}/'
+
+        # Should not accept a chunk out of order.
+
+        response = client.put(url, params={'offset': 1}, content=content[1:], headers=headers)
+        assert response.status_code == 409
+
+        response = client.put(url, params={'offset': 0}, content=content, headers=headers)
+        assert response.status_code == 200
+        assert response.json()['offset'] == len(content)
+
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        assert response.json()['offset'] == len(content)
+
+        # Should not accept chunks past the end, which would replace the last part.
+        response = client.put(url, params={'offset': len(content)}, content=b'', headers=headers)
+        assert response.status_code == 409
+
+        probe_video_ = 'v2g.modules.uploads.routes.probe_video_for_conversion'
+        with patch(probe_video_) as mock_probe_video:
+            response = client.post(get_finalize_url(upload['id']), headers=headers)
+            assert response.status_code == 200
+            conversion_id = response.json()['id']
+
+        mock_probe_video.delay.assert_called_once_with(conversion_id)
+
+
+@pytest.mark.asyncio
+async def test_should_count_finalized_uploads_against_conversion_limit(mongo_client, video_file):
+    user_id, token = await create_user_and_token(mongo_client)
+    headers = {'Authorization': 'Bearer ' + token.access_token}
+    content = video_file.read()
+
+    # Leave room for two conversions only.
+    for item in parse_many(settings.rate_limit_create_conversions):
+        limiter.limiter.hit(item, f'user:{user_id}', CREATE_CONVERSIONS_SCOPE, cost=item.amount - 2)
+
+    with TestClient(app) as client:
+        probe_video_ = 'v2g.modules.conversions.routes.probe_video_for_conversion'
+        with patch(probe_video_):
+            response = client.post(
+                URL_CONVERSIONS,
+                files={'file': ('video.mp4', io.BytesIO(content))},
+                headers=headers,
+            )
+            assert response.status_code == 200
+
+        response = client.post(
+            URL_UPLOADS,
+            json={'content_type': 'video/mp4', 'size': len(content)},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        upload = response.json()
+        response = httpx.post(upload['url'], data=upload['fields'], files={'file': content})
+        assert response.is_success
+
+        response = client.post(
+            URL_UPLOADS + 'resumable/',
+            json={'content_type': 'video/mp4', 'size': len(content)},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        resumable_upload = response.json()
+        response = client.put(
+            f'{URL_UPLOADS}resumable/{resumable_upload["id"]}/',
+            params={'offset': 0},
+            content=content,
+            headers=headers,
+        )
+        assert response.status_code == 200
+
+        probe_video_ = 'v2g.modules.uploads.routes.probe_video_for_conversion'
+        with patch(probe_video_) as mock_probe_video:
+            response = client.post(get_finalize_url(upload['id']), headers=headers)
+            assert response.status_code == 200
+
+            # The quota is used up by now.
+            response = client.post(get_finalize_url(resumable_upload['id']), headers=headers)
+            assert response.status_code == 429
+
+        mock_probe_video.delay.assert_called_once()
+
+        # Nothing was taken, so it can be finalized once there is room again.
+        response = client.get(f'{URL_UPLOADS}resumable/{resumable_upload["id"]}/', headers=headers)
+        assert response.json()['status'] == 'pending'
@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 import bson
 import pytest
 from fastapi.testclient import TestClient
@@ -63,13 +65,17 @@ async def test_should_get_400_if_user_exists(mongo_client):
     password = 'testtest'
     await create_user(username, password, mongo_client)
 
-    with TestClient(app) as client:
+    get_password_hash_ = 'v2g.modules.users.repositories.get_password_hash'
+    with TestClient(app) as client, patch(get_password_hash_) as mock_get_password_hash:
         response = client.post(URL_USERS, json={'username': username, 'password': password})
         assert response.status_code == 400
 
         result = response.json()
         assert result['detail'] == 'This username is already taken.'
 
+    # Hashing is skipped for a taken username.
+    mock_get_password_hash.assert_not_called()
+
 
 @pytest.mark.asyncio
 async def test_should_get_my_user_info(mongo_client):
@@ -88,6 +94,7 @@ async def test_should_get_my_user_info(mongo_client):
         assert result['id'] == str(user_id)
         assert result['username'] == username
         assert result['conversions'] == []
+        assert result['conversion_counts'] == {}
 
 
 @pytest.mark.asyncio
@@ -6,6 +6,7 @@ import bson
 import pytest
 from fastapi.testclient import TestClient
 
+import v2g.tasks as tasks
 from v2g.app import app
 from v2g.core.config import settings
 
@@ -86,3 +87,87 @@ async def test_ws_does_not_receive_other_users_events(mongo_client, redis_client
             t.join()
 
     assert received == own_event
+
+
+@pytest.mark.asyncio
+async def test_ws_replays_missed_events(mongo_client, redis_client):
+    user_id, token = await create_user_and_token(mongo_client)
+    tasks._publish_event(user_id, {'conversion_id': '1', 'status': 'processing'})
+    tasks._publish_event(user_id, {'conversion_id': '1', 'status': 'done'})
+    (first_id, _), (second_id, _) = redis_client.xrange(f'user:{user_id}:log')
+
+    query = f'?token={token.access_token}&last_event_id={first_id.decode()}'
+    with TestClient(app) as client:
+        with client.websocket_connect(URL_WS + query) as ws:
+            received = json.loads(ws.receive_text())
+
+    assert received == {'event_id': second_id.decode(), 'conversion_id': '1', 'status': 'done'}
+
+
+@pytest.mark.asyncio
+async def test_ws_filters_events(mongo_client, redis_client):
+    user_id, token = await create_user_and_token(mongo_client)
+    channel = f'user:{user_id}:events'
+    conversion_id = str(bson.ObjectId())
+
+    other_event = {'conversion_id': str(bson.ObjectId()), 'status': 'done'}
+    own_event = {'conversion_id': conversion_id, 'status': 'done'}
+
+    with TestClient(app) as client:
+        with client.websocket_connect(URL_WS + f'?token={token.access_token}') as ws:
+            ws.send_text(json.dumps({'conversion_ids': [conversion_id]}))
+            ack = json.loads(ws.receive_text())
+            assert ack['filter']['conversion_ids'] == [conversion_id]
+
+            wait_for_subscription(redis_client, channel)
+            redis_client.publish(channel, json.dumps(other_event))
+            redis_client.publish(channel, json.dumps(own_event))
+            received = json.loads(ws.receive_text())
+
+    assert received == own_event
+
+
+@pytest.mark.asyncio
+async def test_ws_rejects_invalid_filter(mongo_client):
+    _, token = await create_user_and_token(mongo_client)
+
+    with TestClient(app) as client:
+        with client.websocket_connect(URL_WS + f'?token={token.access_token}') as ws:
+            ws.send_text(json.dumps({'statuses': ['unknown']}))
+            assert 'error' in json.loads(ws.receive_text())
+
+
+@pytest.mark.asyncio
+async def test_ws_rejects_binary_frames(mongo_client):
+    _, token = await create_user_and_token(mongo_client)
+
+    with TestClient(app) as client:
+        with client.websocket_connect(URL_WS + f'?token={token.access_token}') as ws:
+            ws.send_bytes(b'{}')
+            assert json.loads(ws.receive_text())['error'][0]['type'] == 'frame_type'
+
+
+@pytest.mark.asyncio
+async def test_ws_coalesces_events_of_a_conversion(mongo_client, redis_client, monkeypatch):
+    # Long enough for all the events to come within the window even on a slow machine.
+    monkeypatch.setattr(settings, 'events_coalesce_window_in_seconds', 2.0)
+    user_id, token = await create_user_and_token(mongo_client)
+    channel = f'user:{user_id}:events'
+    conversion_id = str(bson.ObjectId())
+
+    with TestClient(app) as client:
+        with client.websocket_connect(URL_WS + f'?token={token.access_token}') as ws:
+            wait_for_subscription(redis_client, channel)
+            for progress in (0.1, 0.2, 0.3):
+                event = {
+                    'conversion_id': conversion_id,
+                    'status': 'processing',
+                    'progress': progress,
+                }
+                redis_client.publish(channel, json.dumps(event))
+            redis_client.publish(
+                channel, json.dumps({'conversion_id': conversion_id, 'status': 'done'})
+            )
+            received = json.loads(ws.receive_text())
+
+    assert received == {'conversion_id': conversion_id, 'status': 'done'}
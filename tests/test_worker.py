@@ -0,0 +1,39 @@
+import os
+
+from v2g.core.config import settings
+from v2g.worker import acquire_cpu_budget
+
+
+def test_should_give_running_conversions_disjoint_cores(monkeypatch, tmp_path):
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda _: {0, 1, 2, 3})
+    monkeypatch.setattr(settings, 'celery_concurrency', 2)
+    monkeypatch.setattr(settings, 'conversion_cpu_lock_dir', str(tmp_path))
+
+    with acquire_cpu_budget() as first, acquire_cpu_budget() as second:
+        assert first == ([0, 1], 2)
+        assert second == ([2, 3], 2)
+
+        with acquire_cpu_budget() as third:
+            assert third == (None, 2)
+
+    with acquire_cpu_budget() as budget:
+        assert budget == ([0, 1], 2)
+
+
+def test_should_share_left_over_cores(monkeypatch, tmp_path):
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda _: {0, 1, 2, 3, 4, 5})
+    monkeypatch.setattr(settings, 'celery_concurrency', 4)
+    monkeypatch.setattr(settings, 'conversion_cpu_lock_dir', str(tmp_path))
+
+    with acquire_cpu_budget() as first, acquire_cpu_budget() as second:
+        # Two cores are left for each of the other two slots.
+        assert first == ([0], 1)
+        assert second == ([1], 1)
+
+        with acquire_cpu_budget() as third, acquire_cpu_budget() as fourth:
+            assert third == ([2, 3], 2)
+            assert fourth == ([4, 5], 2)
+
+        # The free cores are split between the free slots again.
+        with acquire_cpu_budget() as third:
+            assert third == ([2, 3], 2)
@@ -4,12 +4,15 @@ from v2g.modules.auth.models import Token
 
 
 async def create_user(username, password, mongo_client):
+    # Usernames are unique.
+    await delete_user(username, mongo_client)
+
     db = mongo_client.get_database(settings.mongodb.dbname)
     collection = db.get_collection('users')
     result = await collection.insert_one(
         {
             'username': username,
-            'password': get_password_hash(password),
+            'password': await get_password_hash(password),
         }
     )
     return result.inserted_id